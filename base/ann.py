@@ -0,0 +1,160 @@
+# approximate nearest neighbour index for the TF-IDF similarity engine, used when SIMILARITY_BACKEND is 'ivf'
+# the TF-IDF rows are reduced to dense vectors with truncated SVD and partitioned by spherical k-means
+# (an inverted file, IVF), so a query only scores the movies in its settings.ANN_NPROBE closest partitions,
+# then rescores those candidates exactly against the TF-IDF matrix. Built by the build_ann_index command,
+# and extended by similarity.update_model (see update_index) so movies written since are found too.
+
+import json
+import os
+import numpy as np
+from django.conf import settings
+from sklearn.decomposition import TruncatedSVD
+from . import model_store
+
+MODEL_NAME = 'tfidf_ann'
+KMEANS_SAMPLE = 100000 # vectors the partition centroids are trained on
+BLOCK_SIZE = 65536 # vectors assigned to partitions per matrix product
+
+
+class IvfIndex:
+    """Dense movie vectors grouped by partition, with each partition's centroid.
+
+    The vectors of partition p are rows offsets[p]:offsets[p + 1] of `vectors`, and movie_ids[row] is the movie of each row.
+    `components` projects a TF-IDF row into the vector space; `fit_version` is the TF-IDF fit it was built from,
+    whose vocabulary `components` is over, and `model_version` the TF-IDF model version whose rows it holds.
+    """
+
+    def __init__(self, components, centroids, vectors, offsets, movie_ids, fit_version, model_version, version=None):
+        self.components = components
+        self.centroids = centroids
+        self.vectors = vectors
+        self.offsets = offsets
+        self.movie_ids = movie_ids
+        self.fit_version = fit_version
+        self.model_version = model_version
+        self.version = version
+
+    def project(self, tfidf_rows):
+        """Returns the L2 normalised dense vectors of sparse TF-IDF rows."""
+        return _normalise(np.asarray(tfidf_rows @ self.components.T, dtype=np.float32))
+
+    def candidates(self, query_vector, count, nprobe):
+        """Returns the movie_ids of up to `count` movies closest to `query_vector` in its `nprobe` closest partitions."""
+        nprobe = min(nprobe, len(self.centroids))
+        probed = np.argpartition(-(self.centroids @ query_vector), nprobe - 1)[:nprobe]
+        rows = np.concatenate([np.arange(self.offsets[part], self.offsets[part + 1]) for part in probed])
+        if len(rows) > count:
+            rows = rows[np.argpartition(-(self.vectors[rows] @ query_vector), count - 1)[:count]]
+        return self.movie_ids[rows]
+
+
+def build_index(model, components, lists=0, iterations=10, seed=0):
+    """Builds an index over a TF-IDF model's rows; `lists` partitions, or about sqrt(movies) when 0."""
+    rows = model.matrix.shape[0]
+    components = max(min(components, model.matrix.shape[1] - 1, rows - 1), 1)
+    svd = TruncatedSVD(n_components=components, random_state=seed).fit(model.matrix)
+    components = svd.components_.astype(np.float32)
+    vectors = _normalise((model.matrix @ components.T).astype(np.float32))
+
+    lists = max(min(lists or int(np.sqrt(rows)), rows), 1)
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(rows, size=min(rows, KMEANS_SAMPLE), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=lists, replace=False)]
+    for _ in range(iterations):
+        assignments = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        empty = ~sums.any(axis=1)
+        sums[empty] = centroids[empty] # a partition nothing was assigned to keeps its centroid
+        centroids = _normalise(sums)
+
+    assignments = _assign(vectors, centroids)
+    order = np.argsort(assignments, kind='stable')
+    offsets = np.searchsorted(assignments[order], np.arange(lists + 1))
+    return IvfIndex(components, centroids, vectors[order], offsets, model.movie_ids[order], model.fit_version, model.version)
+
+def update_index(model, movie_ids):
+    """Replaces or adds the given movies' vectors in the published index, in their closest partitions, and publishes it.
+
+    Called when an incremental TF-IDF update publishes `model`. Returns the new index, or None when there is
+    no index built from the model's fit to update.
+    """
+    version = model_store.current_version(MODEL_NAME)
+    if version is None:
+        return None
+    index = load_index(version)
+    if index.fit_version != model.fit_version:
+        return None
+    rows = [row for row in map(model.row_for, sorted(set(movie_ids))) if row is not None]
+    added_vectors = index.project(model.matrix[rows])
+    keep = ~np.isin(index.movie_ids, model.movie_ids[rows])
+    partitions = np.repeat(np.arange(len(index.centroids)), np.diff(index.offsets))
+    partitions = np.concatenate([partitions[keep], _assign(added_vectors, index.centroids)])
+    order = np.argsort(partitions, kind='stable')
+    updated = IvfIndex(
+        index.components, index.centroids,
+        np.concatenate([index.vectors[keep], added_vectors])[order],
+        np.searchsorted(partitions[order], np.arange(len(index.centroids) + 1)),
+        np.concatenate([index.movie_ids[keep], model.movie_ids[rows]])[order],
+        index.fit_version, model.version,
+    )
+    save_index(updated)
+    return updated
+
+def save_index(index):
+    """Writes an index to a new version directory, publishes it and returns the version."""
+    version = model_store.new_version()
+    path = model_store.create_version_dir(MODEL_NAME, version)
+    for name in ('components', 'centroids', 'vectors', 'offsets', 'movie_ids'):
+        np.save(os.path.join(path, f'{name}.npy'), getattr(index, name))
+    with open(os.path.join(path, 'meta.json'), 'w') as meta_file:
+        json.dump({'version': version, 'fit_version': index.fit_version, 'model_version': index.model_version, 'movies': len(index.movie_ids),
+                   'lists': len(index.centroids), 'components': len(index.components)}, meta_file)
+    model_store.publish(MODEL_NAME, version)
+    index.version = version
+    return version
+
+def load_index(version):
+    """Reads a stored index version, memory mapping the movie vectors."""
+    path = model_store.version_dir(MODEL_NAME, version)
+    with open(os.path.join(path, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
+    return IvfIndex(
+        np.load(os.path.join(path, 'components.npy')),
+        np.load(os.path.join(path, 'centroids.npy')),
+        np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r'),
+        np.load(os.path.join(path, 'offsets.npy')),
+        np.load(os.path.join(path, 'movie_ids.npy')),
+        meta['fit_version'],
+        meta.get('model_version'),
+        version,
+    )
+
+# The index loaded by this worker process
+published_index = model_store.PublishedModel(MODEL_NAME, load_index)
+
+def similar_movie_ids(model, query_vec, movie_id, top_n):
+    """Returns the movie_ids of the approximately top_n movies most similar to a TF-IDF query row, best first.
+
+    Returns None when the published index does not hold the model's rows, so the caller can score exactly.
+    Candidates are rescored exactly, so only recall is approximate; raise settings.ANN_NPROBE to trade speed for recall.
+    """
+    index = published_index.get()
+    if index is None or index.model_version != model.version or top_n <= 0:
+        return None
+    candidate_ids = index.candidates(index.project(query_vec)[0], top_n * settings.ANN_CANDIDATES + 1, settings.ANN_NPROBE)
+    rows = [row for row in map(model.row_for, candidate_ids.tolist()) if row is not None and model.movie_ids[row] != movie_id]
+    if not rows:
+        return []
+    scores = (model.matrix[rows] @ query_vec.T).toarray().ravel()
+    top = np.argsort(-scores, kind='stable')[:top_n]
+    return [int(model.movie_ids[rows[position]]) for position in top]
+
+def _assign(vectors, centroids):
+    return np.concatenate([
+        np.argmax(vectors[start:start + BLOCK_SIZE] @ centroids.T, axis=1) for start in range(0, len(vectors), BLOCK_SIZE)
+    ]) if len(vectors) else np.empty(0, dtype=np.int64)
+
+def _normalise(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
@@ -4,4 +4,7 @@ from django.apps import AppConfig
 
 class BaseConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'base'
\ No newline at end of file
+    name = 'base'
+
+    def ready(self):
+        from . import signals  # registers the signal receivers
@@ -0,0 +1,104 @@
+# per-process indexes over the movie catalogue
+# each worker builds them once and rebuilds them when the catalogue changes, which other processes
+# announce with mark_changed (write_movies does this once per load) and which this process also
+# learns about from Movie saves and deletes (see signals.py)
+
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from . import model_store
+
+STAMP_NAME = 'catalog'
+
+
+class ChangeStamp:
+    """A stamp that changes whenever the data it stands for changes, in this process or, once published, in any process."""
+
+    def __init__(self, name):
+        self.name = name
+        self.local_changes = 0 # changes seen by this process
+
+    def version(self):
+        return (model_store.current_version(self.name), self.local_changes)
+
+    def mark_changed(self, publish=False):
+        """Records a change in this process, and in every process when `publish` is set."""
+        self.local_changes += 1
+        if publish:
+            model_store.bump(self.name)
+
+
+class SharedCacheStamp(ChangeStamp):
+    """A ChangeStamp kept in the shared cache, cheap enough to publish from every request that changes its data.
+
+    Every change is published, and this process sees its own changes at its next check like any other,
+    so an index built from it is rebuilt at most once per check interval however often the data changes.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.key = f'change_stamp:{name}'
+
+    def version(self):
+        return (cache.get_or_set(self.key, time.time_ns, timeout=None), self.local_changes)
+
+    def mark_changed(self, publish=True):
+        try:
+            cache.incr(self.key)
+        except ValueError:  # not cached yet, or evicted
+            cache.set(self.key, time.time_ns(), timeout=None)
+
+catalog_stamp = ChangeStamp(STAMP_NAME)
+
+def catalog_version():
+    """Returns a stamp that changes whenever the movie catalogue changes."""
+    return catalog_stamp.version()
+
+def mark_changed(publish=False):
+    """Records a catalogue change in this process, and in every process when `publish` is set."""
+    catalog_stamp.mark_changed(publish)
+
+
+class CatalogIndex:
+    """A structure built from the movie catalogue that is rebuilt when the catalogue changes.
+
+    The shared catalogue stamp is checked at most every settings.CATALOG_CHECK_INTERVAL seconds,
+    so reading an index is usually just an attribute lookup. Pass another ChangeStamp, and the name
+    of the setting holding its check interval, to build from other data the same way.
+    """
+
+    def __init__(self, build, stamp=catalog_stamp, interval='CATALOG_CHECK_INTERVAL'):
+        self._build = build
+        self._stamp = stamp
+        self._interval = interval
+        self._value = None
+        self._version = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns the index, building or rebuilding it first if needed."""
+        now = time.monotonic()
+        if (self._value is not None and self._version[1] == self._stamp.local_changes
+                and now - self._checked < getattr(settings, self._interval)):
+            return self._value
+
+        with self._lock:
+            version = self._stamp.version()
+            if self._value is None or version != self._version:
+                self._value = self._build()
+                self._version = version
+            self._checked = now
+        return self._value
+
+    @property
+    def loaded(self):
+        """Whether the index has been built in this process, without building it."""
+        return self._value is not None
+
+    def reset(self):
+        """Drops the index so the next get rebuilds it."""
+        with self._lock:
+            self._value = None
+            self._version = None
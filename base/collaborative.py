@@ -0,0 +1,100 @@
+# collaborative filtering engine used by utils.rerank_recommendations
+# every rating is loaded once into a sparse user x movie matrix, so user similarities
+# and predicted ratings are a handful of sparse products instead of a query per user.
+# Each worker keeps the matrix in memory and rebuilds it when ratings change (see signals.py),
+# at most once per settings.RATING_MATRIX_REFRESH_INTERVAL so a busy site does not reload it per rating
+
+import numpy as np
+from scipy import sparse
+from .models import Rating
+from .catalog import CatalogIndex, SharedCacheStamp
+
+
+class RatingMatrix:
+    """Every rating as a user x movie CSR matrix, with the user and movie of each row and column."""
+
+    def __init__(self, matrix, user_ids, movie_ids):
+        self.matrix = matrix
+        self.user_ids = user_ids
+        self.movie_ids = movie_ids
+        self.user_index = dict(zip(user_ids.tolist(), range(len(user_ids))))
+        self.movie_index = dict(zip(movie_ids.tolist(), range(len(movie_ids))))
+        # which users rated which movies, and the squared ratings, shared by every user_similarities call
+        self.rated = matrix.copy()
+        self.rated.data[:] = 1
+        self.squared = matrix.multiply(matrix).tocsr()
+
+
+def load_rating_matrix():
+    """Loads the whole Rating table in one query."""
+    rows = list(Rating.objects.values_list('user_id', 'movie_id', 'rating'))
+    if not rows:
+        return RatingMatrix(sparse.csr_matrix((0, 0)), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+    users, movies, ratings = (np.asarray(column) for column in zip(*rows))
+    user_ids, user_rows = np.unique(users, return_inverse=True)
+    movie_ids, movie_columns = np.unique(movies, return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (ratings.astype(np.float64), (user_rows, movie_columns)), shape=(len(user_ids), len(movie_ids))
+    )
+    return RatingMatrix(matrix, user_ids.astype(np.int64), movie_ids.astype(np.int64))
+
+# changes whenever a rating is saved or deleted, which happens on the request path
+ratings_stamp = SharedCacheStamp('ratings')
+# The rating matrix of this worker process, reloaded at most every RATING_MATRIX_REFRESH_INTERVAL seconds
+rating_matrix = CatalogIndex(load_rating_matrix, stamp=ratings_stamp, interval='RATING_MATRIX_REFRESH_INTERVAL')
+
+def get_rating_matrix():
+    """Returns this process's rating matrix, rebuilding it first if ratings changed since it was last checked."""
+    return rating_matrix.get()
+
+def user_similarities(ratings, user_row):
+    """Returns the cosine similarity of one user to every other user over the movies both have rated."""
+    matrix = ratings.matrix
+    target = matrix[user_row]
+    target_rated = ratings.rated[user_row]
+
+    dot_products = (matrix @ target.T).toarray().ravel()
+    other_norms = (ratings.squared @ target_rated.T).toarray().ravel() # each user's squared ratings on the target's movies
+    target_norms = (ratings.rated @ ratings.squared[user_row].T).toarray().ravel() # the target's squared ratings on each user's movies
+    denominators = np.sqrt(other_norms * target_norms)
+
+    similarities = np.divide(dot_products, denominators, out=np.zeros_like(dot_products), where=denominators > 0)
+    similarities[user_row] = 0 # users are not their own neighbours
+    return similarities
+
+def predict_ratings(ratings, similarities, movie_ids, polarities=None):
+    """Predicts ratings for `movie_ids` as the similarity weighted ratings of the users who rated them.
+
+    Each rating counts once as given and once weighted by 1 + the polarity of that user's review
+    of the movie (`polarities` maps (user_id, movie_id) to polarity), so positive reviews pull the
+    prediction up and negative ones pull it down. Returns a dict of movie_id to prediction, 0 when nobody similar rated it.
+    """
+    columns = [ratings.movie_index.get(movie_id) for movie_id in movie_ids]
+    present = [index for index, column in enumerate(columns) if column is not None]
+    predictions = dict.fromkeys(movie_ids, 0)
+    if not present:
+        return predictions
+
+    candidate_ids = [movie_ids[index] for index in present]
+    candidate_ratings = ratings.matrix[:, [columns[index] for index in present]].tocsr()
+    rated = candidate_ratings.copy()
+    rated.data[:] = 1
+    weighted = 2 * candidate_ratings
+    if polarities:
+        candidate_columns = dict(zip(candidate_ids, range(len(candidate_ids))))
+        reviewed = [
+            (ratings.user_index[user_id], candidate_columns[movie_id], polarity)
+            for (user_id, movie_id), polarity in polarities.items()
+            if user_id in ratings.user_index and movie_id in candidate_columns
+        ]
+        if reviewed:
+            review_rows, review_columns, review_polarities = zip(*reviewed)
+            polarity_matrix = sparse.csr_matrix((review_polarities, (review_rows, review_columns)), shape=candidate_ratings.shape)
+            weighted = weighted + candidate_ratings.multiply(polarity_matrix) # only counts reviews by users who rated the movie
+
+    numerators = weighted.T @ similarities
+    denominators = 2 * (rated.T @ similarities)
+    for index, numerator, denominator in zip(present, numerators, denominators):
+        if denominator > 0:
+            predictions[movie_ids[index]] = numerator / denominator
+    return predictions
@@ -0,0 +1,101 @@
+# item to item "people who liked X also liked" model used by views.get_recommendations
+# built offline from Rating by the build_item_similarity command (run it on a schedule, e.g. nightly),
+# so a recommendation is a sum over the precomputed rows of the user's liked movies
+
+import json
+import os
+import numpy as np
+from scipy import sparse
+from .models import Rating
+from . import model_store
+
+MODEL_NAME = 'item_similarity'
+LIKED_RATING = 4 # ratings at or above this count as a like
+BLOCK_SIZE = 1024 # movies scored per sparse product when building
+
+
+class ItemSimilarityModel:
+    """A movie x movie matrix holding each movie's top co-liked movies, and the movie_id of every row and column."""
+
+    def __init__(self, matrix, movie_ids, version=None):
+        self.matrix = matrix
+        self.movie_ids = movie_ids
+        self.row_index = dict(zip(movie_ids.tolist(), range(len(movie_ids))))
+        self.version = version
+
+
+def fit_model(top_k, liked_rating=LIKED_RATING):
+    """Builds the model from every like, or returns None if nobody has liked anything."""
+    likes = list(Rating.objects.filter(rating__gte=liked_rating).values_list('user_id', 'movie_id'))
+    if not likes:
+        return None
+    users, movies = (np.asarray(column) for column in zip(*likes))
+    _, user_rows = np.unique(users, return_inverse=True)
+    movie_ids, movie_columns = np.unique(movies, return_inverse=True)
+    liked = sparse.csr_matrix((np.ones(len(likes)), (user_rows, movie_columns)), shape=(user_rows.max() + 1, len(movie_ids)))
+    liked.data[:] = 1 # a user liking a movie twice still counts once
+
+    # cosine similarity of the movies' "liked by" vectors: co-likes / sqrt(likes of each)
+    like_counts = np.asarray(liked.sum(axis=0)).ravel()
+    inverse_norms = sparse.diags(1 / np.sqrt(like_counts))
+    liked_by = (liked @ inverse_norms).T.tocsr()
+    liked_normalised = (liked @ inverse_norms).tocsc()
+
+    blocks = []
+    for start in range(0, len(movie_ids), BLOCK_SIZE):
+        block = (liked_by[start:start + BLOCK_SIZE] @ liked_normalised).tocoo()
+        block.data[block.row + start == block.col] = 0 # a movie is not its own neighbour
+        blocks.append(_keep_top_k(block.tocsr(), top_k))
+    matrix = sparse.vstack(blocks).tocsr() if blocks else sparse.csr_matrix((0, 0))
+    matrix.eliminate_zeros()
+    return ItemSimilarityModel(matrix.astype(np.float32), movie_ids.astype(np.int64))
+
+def save_model(model):
+    """Writes a model to a new version directory, publishes it and returns the version."""
+    version = model_store.new_version()
+    path = model_store.create_version_dir(MODEL_NAME, version)
+    sparse.save_npz(os.path.join(path, 'matrix.npz'), model.matrix, compressed=False)
+    np.save(os.path.join(path, 'movie_ids.npy'), model.movie_ids)
+    with open(os.path.join(path, 'meta.json'), 'w') as meta_file:
+        json.dump({'version': version, 'movies': len(model.movie_ids), 'pairs': int(model.matrix.nnz)}, meta_file)
+    model_store.publish(MODEL_NAME, version)
+    model.version = version
+    return version
+
+def load_model(version):
+    """Reads a stored model version back into memory."""
+    path = model_store.version_dir(MODEL_NAME, version)
+    matrix = sparse.load_npz(os.path.join(path, 'matrix.npz')).tocsr()
+    return ItemSimilarityModel(matrix, np.load(os.path.join(path, 'movie_ids.npy')), version)
+
+# The model loaded by this worker process
+published_model = model_store.PublishedModel(MODEL_NAME, load_model)
+
+def recommend(liked_movie_ids, count, exclude=()):
+    """Returns up to `count` movie_ids most co-liked with `liked_movie_ids`, best first."""
+    model = published_model.get()
+    if model is None or count <= 0:
+        return []
+    rows = [model.row_index[movie_id] for movie_id in liked_movie_ids if movie_id in model.row_index]
+    if not rows:
+        return []
+
+    scores = np.asarray(model.matrix[rows].sum(axis=0)).ravel()
+    excluded = [model.row_index[movie_id] for movie_id in set(liked_movie_ids) | set(exclude) if movie_id in model.row_index]
+    scores[excluded] = 0
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > count:
+        candidates = candidates[np.argpartition(-scores[candidates], count - 1)[:count]]
+    ranked = candidates[np.argsort(-scores[candidates], kind='stable')]
+    return model.movie_ids[ranked].tolist()
+
+def _keep_top_k(block, top_k):
+    """Keeps only the top_k largest entries of each row of a CSR block."""
+    block = block.tocsr()
+    for row in range(block.shape[0]):
+        start, end = block.indptr[row], block.indptr[row + 1]
+        if end - start > top_k:
+            row_data = block.data[start:end]
+            row_data[np.argpartition(row_data, end - start - top_k)[:end - start - top_k]] = 0
+    block.eliminate_zeros()
+    return block
@@ -0,0 +1,56 @@
+# management/commands/backfill_review_sentiment.py
+# Scores the sentiment of reviews saved before sentiment was stored on Review.
+# New reviews are scored when they are saved (see signals.py), so this only needs to run once,
+# or with --all after changing how sentiment is scored
+
+from multiprocessing import Pool
+from django.core.management.base import BaseCommand
+from base.models import Review
+from base import sentiment
+
+class Command(BaseCommand):
+    help = 'Stores the sentiment of reviews that have not been scored yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch_size', type=int, default=1000, help='Reviews scored and written per batch')
+        parser.add_argument('--workers', type=int, default=1, help='Processes scoring reviews in parallel')
+        parser.add_argument('--all', action='store_true', help='Rescore every review, not just unscored ones')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        workers = options['workers']
+        reviews = Review.objects.order_by('pk')
+        if not options['all']:
+            reviews = reviews.filter(sentiment__isnull=True)
+
+        pool = Pool(workers) if workers > 1 else None
+        scored = 0
+        last_pk = 0
+        try:
+            while True:
+                # keyset pagination, so each batch is an indexed range scan however far in we are
+                batch = list(reviews.filter(pk__gt=last_pk).values_list('pk', 'review')[:batch_size])
+                if not batch:
+                    break
+                pks, texts = zip(*batch)
+                if pool:
+                    chunk_size = max(len(texts) // workers, 1)
+                    scores = [score for chunk in pool.map(sentiment.polarities, _chunks(texts, chunk_size)) for score in chunk]
+                else:
+                    scores = sentiment.polarities(texts)
+
+                Review.objects.bulk_update(
+                    [Review(pk=pk, sentiment=score) for pk, score in zip(pks, scores)], ['sentiment']
+                )
+                scored += len(batch)
+                last_pk = pks[-1]
+                self.stdout.write(f'Scored {scored} reviews')
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully stored sentiment for {scored} reviews.'))
+
+def _chunks(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)]
@@ -0,0 +1,28 @@
+# management/commands/build_ann_index.py
+# Builds the approximate nearest neighbour index over the published TF-IDF model and publishes it.
+# Only used when SIMILARITY_BACKEND is 'ivf'. Run it after build_tfidf; incremental TF-IDF updates
+# add their movies to the index, a full refit makes similarity fall back to exact scoring until it is rebuilt
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from base import ann, similarity
+
+class Command(BaseCommand):
+    help = 'Builds the IVF nearest neighbour index used for approximate content similarity'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--components', type=int, default=settings.ANN_COMPONENTS,
+                            help='Dimensions the TF-IDF rows are reduced to')
+        parser.add_argument('--lists', type=int, default=settings.ANN_LISTS,
+                            help='Partitions to split the movies into, 0 for about the square root of the movie count')
+
+    def handle(self, *args, **options):
+        model = similarity.get_model()
+        if model is None:
+            raise CommandError('There is no TF-IDF model to index - run write_movies and build_tfidf first.')
+
+        index = ann.build_index(model, options['components'], options['lists'])
+        version = ann.save_index(index)
+        self.stdout.write(self.style.SUCCESS(
+            f'Published ANN index version {version} ({len(index.movie_ids)} movies, {len(index.centroids)} partitions).'
+        ))
@@ -0,0 +1,28 @@
+# management/commands/build_item_similarity.py
+# Builds the "people who liked X also liked" model from every rating and publishes it.
+# Ratings change all the time, so run this on a schedule (e.g. nightly with cron);
+# the web workers pick up each new version without a restart
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from base import item_similarity
+
+class Command(BaseCommand):
+    help = 'Builds the item to item co-rating model used for homepage recommendations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top_k', type=int, default=settings.ITEM_SIMILARITY_NEIGHBOURS,
+                            help='Co-liked movies kept per movie')
+        parser.add_argument('--liked_rating', type=int, default=item_similarity.LIKED_RATING,
+                            help='Lowest rating that counts as a like')
+
+    def handle(self, *args, **options):
+        model = item_similarity.fit_model(options['top_k'], options['liked_rating'])
+        if model is None:
+            self.stdout.write(self.style.WARNING('Nobody has liked any movies yet, no model was built.'))
+            return
+
+        version = item_similarity.save_model(model)
+        self.stdout.write(self.style.SUCCESS(
+            f'Published item similarity model version {version} ({len(model.movie_ids)} movies, {model.matrix.nnz} pairs).'
+        ))
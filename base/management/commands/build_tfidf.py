@@ -0,0 +1,25 @@
+# management/commands/build_tfidf.py
+# Fits the TF-IDF similarity model over every movie and publishes it for the web workers,
+# which pick up the new version without a restart
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from base import similarity
+
+class Command(BaseCommand):
+    help = 'Fits the TF-IDF similarity model and publishes it to the model directory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top_k', type=int, default=settings.SIMILARITY_NEIGHBOURS,
+                            help='Similar movies to precompute per movie, 0 to skip the neighbour table')
+
+    def handle(self, *args, **options):
+        model = similarity.fit_model()
+        if model is None:
+            raise CommandError('There are no movies to fit the TF-IDF model on - run write_movies first.')
+        similarity.attach_neighbours(model, options['top_k'])
+
+        version = similarity.save_model(model)
+        self.stdout.write(self.style.SUCCESS(
+            f'Published TF-IDF model version {version} ({model.matrix.shape[0]} movies, {model.matrix.shape[1]} terms).'
+        ))
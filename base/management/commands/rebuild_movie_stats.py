@@ -0,0 +1,15 @@
+# management/commands/rebuild_movie_stats.py
+# Recomputes the materialised MovieStats rows from the Rating and Review tables.
+# Stats are kept up to date as ratings and reviews are written, so this is only needed
+# to repair drift, e.g. after ratings are edited or deleted in the admin
+
+from django.core.management.base import BaseCommand
+from base import movie_stats, sections
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-movie rating and review statistics'
+
+    def handle(self, *args, **options):
+        count = movie_stats.rebuild_stats()
+        sections.invalidate_ratings()
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt statistics for {count} movies.'))
@@ -1,22 +1,60 @@
 # management/commands/replace_nan_with_null.py
+# Repairs "nan" values left in Movie columns by older CSV imports, one UPDATE per column.
+# A rule is generated from each nullable column's field type, so new numeric columns are covered without
+# editing this file; text columns are only repaired when listed in NAN_TEXT_FIELDS, and FIELD_RULES adds
+# values a single column should also treat as missing
+
 from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models import Q
 from base.models import Movie
-import numpy as np
+
+# field type -> filter matching the values that mean "missing" for a column of that type
+TYPE_RULES = [
+    ((models.CharField, models.TextField), lambda name: Q(**{f'{name}__iexact': 'nan'})),
+    ((models.FloatField, models.DecimalField), lambda name: Q(**{name: float('nan')})),
+]
+# text columns copied verbatim from movies CSV cells, where older imports stored pandas' NaN as "nan";
+# the other text columns are parsed or computed (names, composite_string, source_hash), so "Nan" there is real
+NAN_TEXT_FIELDS = ['homepage', 'language', 'overview', 'status', 'tagline']
+# column name -> extra filter, combined with its type rule
+FIELD_RULES = {
+    'homepage': Q(homepage=''),
+}
+
+def field_rules():
+    """Returns (column name, filter) for every nullable Movie column that older imports could leave a missing value in."""
+    rules = []
+    for field in Movie._meta.concrete_fields:
+        if not field.null:
+            continue
+        # integer and date columns cannot store NaN, so only their extra rules apply
+        rule = next((build(field.name) for types, build in TYPE_RULES if isinstance(field, types)), None)
+        if isinstance(field, (models.CharField, models.TextField)) and field.name not in NAN_TEXT_FIELDS:
+            rule = None
+        if field.name in FIELD_RULES:
+            rule = FIELD_RULES[field.name] if rule is None else rule | FIELD_RULES[field.name]
+        if rule is not None:
+            rules.append((field.name, rule))
+    return rules
 
 class Command(BaseCommand):
     help = 'Replaces "nan" values with NULL in the Movie model'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--dry_run', action='store_true', help='Only count the values that would be replaced')
+
     def handle(self, *args, **options):
-        fields_to_check = ['budget', 'homepage', 'revenue', 'runtime']  # Add other float/int fields here
+        total = 0
+        with transaction.atomic():
+            for name, rule in field_rules():
+                matches = Movie.objects.filter(rule)
+                count = matches.count() if options['dry_run'] else matches.update(**{name: None})
+                if count:
+                    self.stdout.write(f'{name}: {count}')
+                total += count
 
-        for movie in Movie.objects.all():
-            for field in fields_to_check:
-                value = getattr(movie, field)
-                if isinstance(value, float) and np.isnan(value):  # Check for NaN floats
-                    setattr(movie, field, None)
-                    movie.save(update_fields=[field])  # Update only this field
-                elif isinstance(value, str) and value == 'nan':  # Check for "nan" strings
-                    setattr(movie, field, None)
-                    movie.save(update_fields=[field])
-        
-        self.stdout.write(self.style.SUCCESS('Successfully replaced "nan" values with NULL.'))
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Found {total} "nan" values to replace with NULL.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Successfully replaced {total} "nan" values with NULL.'))
@@ -1,5 +1,6 @@
 # A class for updating the database with CSV data (should the CSV change)
-# note that only new CSV ids are added, no need to delete existing data
+# every CSV movie is upserted: new ids are added and existing movies are rewritten when their source rows
+# changed, movies missing from the CSV are left in place
 # management -> commands are for registering actions
 # https://docs.djangoproject.com/en/5.0/howto/custom-management-commands/
 # update to be run by command line
@@ -7,12 +8,22 @@
 
 import csv
 import json
-from django.core.management.base import BaseCommand, CommandParser
+from multiprocessing import Pool
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import transaction
 from base.models import Movie
+from base import similarity, catalog
+from base.movie_rows import (
+    MOVIE_COLUMNS, clean_title, composite_string, crew_members, extract_release_date, join_names, joined_rows, load_json,
+    merge_chunk, movie_lookup, movie_positions, parse_movies, source_hash,
+)
 import pandas as pd
-import numpy as np
-import re
-from datetime import datetime
+import os
+import tempfile
+import time
+
+# every Movie column except the primary key is overwritten when a movie already exists
+UPDATE_FIELDS = [field.name for field in Movie._meta.concrete_fields if not field.primary_key]
 
 
 class Command(BaseCommand):
@@ -22,212 +33,208 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--credits_csv', type=str, help='Path to credits file')
         parser.add_argument('--movies_csv', type=str, help='Path to movie file')
+        parser.add_argument('--batch_size', type=int, default=1000, help='Movies written per bulk upsert')
+        parser.add_argument('--chunksize', type=int, default=10000, help='Credits rows read into memory at a time')
+        parser.add_argument('--workers', type=int, default=1, help='Processes parsing rows in parallel')
+        parser.add_argument('--checkpoint', type=str, help='File recording progress, so an interrupted load resumes where it stopped')
+        parser.add_argument('--force', action='store_true', help='Rewrite movies whose source rows have not changed')
+        parser.add_argument('--skip_index_update', action='store_true', help='Do not update the TF-IDF similarity index')
 
     # helper functions
-    def import_csv(self, file_path):
-        return pd.read_csv(file_path)
-    
-    # boolean for validation of movie id
-    def invalid_movie_id(self, movie_identifier):
-        try:
-            int(movie_identifier)
-            return Movie.objects.filter(movie_id=movie_identifier).exists
-        except ValueError:
-            return False
-    
+    def import_csv(self, file_path, **kwargs):
+        return pd.read_csv(file_path, **kwargs)
+
+    # the movies file rows at the given data row positions, indexed by id
+    def read_movies(self, file_path, rows):
+        return movie_lookup(self.import_csv(
+            file_path, usecols=lambda column: column in MOVIE_COLUMNS, skiprows=lambda line: line > 0 and line - 1 not in rows
+        ))
+
     # removes unwanted characters from the movie title
     def clean_title(self, movie_title):
-        return re.sub("[^a-zA-Z0-9 ]", "", movie_title)
+        return clean_title(movie_title)
 
     # extract actors and return pipe delimited string
     def extract_actors(self, cast_data):
-        try:
-            cast_df = pd.DataFrame(json.loads(cast_data))
-            return "|".join(cast_df['name'].tolist()) 
-        except (json.JSONDecodeError, KeyError):
-            return ""
+        return join_names(load_json(cast_data), 'name', empty="")
 
     # extract characters and return pipe delimited string
     def extract_characters(self, cast_data):
-        try:
-            cast_df = pd.DataFrame(json.loads(cast_data))
-            return "|".join(cast_df['character'].tolist())
-        except (json.JSONDecodeError, KeyError):
-            return ""
+        return join_names(load_json(cast_data), 'character', empty="")
 
     # extract and return credit data for director, etc as a pipe delimited string
     def extract_crew_member(self, crew_data, job_title):
-        try:
-            crew_df = pd.DataFrame(json.loads(crew_data))
-            members = crew_df[crew_df['job'] == job_title]  # Get all matching rows
-
-            if not members.empty:
-                names = members['name'].tolist()  # Extract all names as a list
-                return "|".join(names)          # Join names with pipe separator
-            else:
-                return None
-
-        except (json.JSONDecodeError, KeyError, IndexError):
-            return None
+        return crew_members(load_json(crew_data), job_title)
 
-        
     # define composite string using regex
     def create_composite_string(self, title, cast_data, crew_data):
-        cleaned_title = self.clean_title(title)
-
-        # Extract actors and characters
-        actor_string = self.extract_actors(cast_data)
-        character_string = self.extract_characters(cast_data)
-        
-        # Split strings into lists and clean individual names/characters
-        cleaned_actors = [re.sub(r"[^a-zA-Z0-9 ]", "", actor) for actor in actor_string.split("|") if actor]
-        cleaned_characters = [re.sub(r"[^a-zA-Z0-9 ]", "", char) for char in character_string.split("|") if char]
-
-        # Extract and clean crew members (director, writer, composer)
-        cleaned_director = self.extract_crew_member(crew_data, 'Director')
-        cleaned_writer = self.extract_crew_member(crew_data, 'Writer')
-        cleaned_composer = self.extract_crew_member(crew_data, 'Composer')
-
-        # Assuming cleaned_director, cleaned_writer, cleaned_composer are already strings,
-        # split them into lists (if not None) and clean individual names
-        cleaned_directors = [re.sub(r"[^a-zA-Z0-9 ]", "", director) for director in cleaned_director.split("|") if director] if cleaned_director else []
-        cleaned_writers = [re.sub(r"[^a-zA-Z0-9 ]", "", writer) for writer in cleaned_writer.split("|") if writer] if cleaned_writer else []
-        cleaned_composers = [re.sub(r"[^a-zA-Z0-9 ]", "", composer) for composer in cleaned_composer.split("|") if composer] if cleaned_composer else []
-
-        cleaned_components = [cleaned_title, *cleaned_actors, *cleaned_characters, *cleaned_directors, *cleaned_writers, *cleaned_composers]
-        composite_string = " ".join(cleaned_components).lower()
-
-        return composite_string
+        return composite_string(title, load_json(cast_data), load_json(crew_data))
 
     # Get genres
     def extract_genres(self, genre_data):
-        try:
-            genre_df = pd.DataFrame(json.loads(genre_data))
-            return "|".join(genre_df['name'].tolist())
-        except (json.JSONDecodeError, KeyError):
-            return None
+        return join_names(load_json(genre_data))
 
     # Get keywords
     def extract_keyword(self, keyword_data):
-        try:
-            keyword_df = pd.DataFrame(json.loads(keyword_data))
-            return "|".join(keyword_df['name'].tolist())
-        except (json.JSONDecodeError, KeyError):
-            return None
+        return join_names(load_json(keyword_data))
 
     # Get production companies
     def extract_production_companies(self, production_companies_data):
-        try:
-            production_companies_df = pd.DataFrame(json.loads(production_companies_data))
-            return "|".join(production_companies_df['name'].tolist())
-        except (json.JSONDecodeError, KeyError):
-            return None
-    
+        return join_names(load_json(production_companies_data))
+
     # Get production countries
     def extract_production_countries(self, production_countries_data):
-        try:
-            production_countries_df = pd.DataFrame(json.loads(production_countries_data))
-            return "|".join(production_countries_df['name'].tolist())
-        except (json.JSONDecodeError, KeyError):
-            return None
+        return join_names(load_json(production_countries_data))
 
     # Get release date in appropriate format for data model
     def extract_release_date(self, date_string):
-        try:
-            if isinstance(date_string, str):
-                # First try parsing with the YYYY-MM-DD format
-                try:
-                    date_obj = datetime.strptime(date_string, '%Y-%m-%d')
-                    return date_obj
-                except ValueError:  # If it fails, try dd/mm/yyyy
-                    date_obj = datetime.strptime(date_string, '%d/%m/%Y')
-                    return date_obj
-            else:
-                raise ValueError(f"Expected string format, got: {date_string}")
-
-        except ValueError:  # Catch invalid date format
-            print(f"Invalid date format: {date_string}")
-            return None  # Or a default date if needed
-    
+        return extract_release_date(date_string)
+
     # Get the spoken languages
     def extract_spoken_languages(self, spoken_language_data):
-        try:
-            spoken_language_df = pd.DataFrame(json.loads(spoken_language_data))
-            return "|".join(spoken_language_df['name'].tolist())
-        except (json.JSONDecodeError, KeyError):
-            return None
-        
-    # write movies to the database assuming the movie id provided is unique
-    # handle naming is a requirement for BaseCommand
-    def handle(self, *args, **options):
-        credits_file_path = options['credits_csv']
-        movies_file_path = options['movies_csv']
-        credits_df = self.import_csv(credits_file_path)
-        movies_df = self.import_csv(movies_file_path)
-
-        for _, row in credits_df.iterrows():
-            
-            movie_identifier = row['movie_id']
-            additional_row = movies_df[movies_df['id'] == movie_identifier].iloc[0]
-
-            movie_title = str(row['title'])
-            cleaned_movie_title = self.clean_title(movie_title) 
-
-            # Extract all actors and characters
-            actor_string = self.extract_actors(row['cast'])
-            character_string = self.extract_characters(row['cast'])
-
-            # Construct the composite string (pass crew data directly)
-            string_representation = self.create_composite_string(
-                movie_title, row['cast'], row['crew'] 
-            )
+        return join_names(load_json(spoken_language_data))
 
-            # Gather the additional data from the movies.csv
-            additional_data = {
-                'budget': additional_row.get('budget', None),
-                'homepage': additional_row.get('homepage', None),
-                'language': additional_row.get('original_language', None),
-                'overview': additional_row.get('overview', None), 
-                'genres': self.extract_genres(additional_row['genres']),
-                'keywords': self.extract_keyword(additional_row['keywords']),
-                'production_companies': self.extract_production_companies(additional_row['production_companies']),
-                'production_countries': self.extract_production_countries(additional_row['production_countries']),
-                'release_date': self.extract_release_date(additional_row['release_date']),
-                'revenue': additional_row.get('revenue', None), 
-                'runtime': additional_row.get('runtime', None),
-                'spoken_languages': self.extract_spoken_languages(additional_row['spoken_languages']),
-                'status': additional_row.get('status', None),
-                'tagline': additional_row.get('tagline', None)
-            }
-
-
-            # Validate integer fields
-            try:
-                additional_data['revenue'] = int(additional_data['revenue'])
-            except (ValueError, TypeError):
-                additional_data['revenue'] = None
-
-            try:
-                additional_data['runtime'] = int(additional_data['runtime'])
-            except (ValueError, TypeError):
-                additional_data['runtime'] = None
-
-            # Populate the Movie objects
-            Movie.objects.update_or_create(
-                movie_id=movie_identifier,
-                defaults={
-                    'title': movie_title,
-                    'cleaned_title': cleaned_movie_title,
-                    'actors': actor_string,
-                    'characters': character_string,
-                    'director': self.extract_crew_member(row['crew'], 'Director'),  
-                    'writer': self.extract_crew_member(row['crew'], 'Writer'),
-                    'composer': self.extract_crew_member(row['crew'], 'Composer'),
-                    'composite_string': string_representation,
-                    **additional_data
-                }
+    # upsert one batch of movies in a single statement
+    def write_batch(self, movies):
+        with transaction.atomic():
+            Movie.objects.bulk_create(
+                movies, update_conflicts=True, unique_fields=['movie_id'], update_fields=UPDATE_FIELDS
             )
 
+    # the rows of a batch whose source rows changed since the movie was last written, with their hashes
+    def changed_records(self, records, force=False):
+        hashes = [source_hash(record) for record in records]
+        if force:
+            return records, hashes
+        stored = dict(Movie.objects.filter(movie_id__in=[int(record['movie_id']) for record in records]).values_list('movie_id', 'source_hash'))
+        changed = [(record, row_hash) for record, row_hash in zip(records, hashes) if stored.get(int(record['movie_id'])) != row_hash]
+        return [record for record, _ in changed], [row_hash for _, row_hash in changed]
+
+    # progress of an earlier run over the same credits file, or a fresh start
+    def read_checkpoint(self, path, credits_csv):
+        try:
+            with open(path) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+        except FileNotFoundError:
+            return {'credits_csv': credits_csv, 'rows': 0, 'written': 0}
+        if checkpoint.get('credits_csv') != credits_csv:
+            raise CommandError(f'{path} records progress through {checkpoint.get("credits_csv")}, not {credits_csv}')
+        return checkpoint
+
+    def write_checkpoint(self, path, checkpoint):
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(temp_path, path)  # a crash mid write leaves the previous checkpoint in place
+
+    # ids of the movies written so far, one per line, read back in order
+    def read_written_ids(self, path):
+        with open(path) as ids_file:
+            for line in ids_file:
+                yield int(line)
 
+    # write movies to the database assuming the movie id provided is unique
+    # handle naming is a requirement for BaseCommand
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        workers = options['workers']
+        checkpoint_path = options['checkpoint']
+        checkpoint = self.read_checkpoint(checkpoint_path, options['credits_csv']) if checkpoint_path else {'rows': 0, 'written': 0}
+        resumed_from = checkpoint['rows']
+        if resumed_from:
+            self.stdout.write(f'Resuming after row {resumed_from} of {options["credits_csv"]}')
+
+        # the credits file is streamed, and only the movies file's ids are held in memory: each credits chunk
+        # reads just the movies rows it joins to, one pass over the movies file per chunk
+        positions = movie_positions(self.import_csv(options['movies_csv'], usecols=['id'])['id'])
+        credits_chunks = self.import_csv(
+            options['credits_csv'], chunksize=options['chunksize'], skiprows=range(1, resumed_from + 1)
+        )
+
+        # the ids written are streamed to a file rather than held in memory, next to the checkpoint
+        # when there is one so the index update after a resume still sees the movies written before it
+        if checkpoint_path:
+            ids_path = f'{checkpoint_path}.ids'
+        else:
+            ids_fd, ids_path = tempfile.mkstemp(suffix='.ids')
+            os.close(ids_fd)
+        ids_file = open(ids_path, 'a' if resumed_from else 'w')
+
+        # rows are parsed in worker processes, but batches come back in order and are written from this one
+        pool = Pool(workers) if workers > 1 else None
+        parse_batches = pool.imap if pool else map
+        written = 0
+        rows_read = 0
+        unchanged = 0
+        started = time.monotonic()
+        try:
+            for credits_chunk in credits_chunks:
+                credits_chunk = credits_chunk.reset_index(drop=True)
+                merged_df = merge_chunk(credits_chunk, self.read_movies(options['movies_csv'], joined_rows(credits_chunk, positions)))
+                skipped = len(credits_chunk) - len(merged_df)
+                if skipped:
+                    self.stdout.write(self.style.WARNING(f'Skipped {skipped} credits rows with no matching movies row'))
+
+                # each batch remembers the credits row it ends on, which is where a resumed run starts
+                batches, hashes, batch_ends = [], [], []
+                for start in range(0, len(merged_df), batch_size):
+                    batch_df = merged_df.iloc[start:start + batch_size]
+                    records, record_hashes = self.changed_records(batch_df.to_dict('records'), options['force'])
+                    unchanged += len(batch_df) - len(records)
+                    batches.append(records)
+                    hashes.append(record_hashes)
+                    batch_ends.append(rows_read + int(batch_df.index[-1]) + 1)
+
+                for parsed, record_hashes, batch_end in zip(parse_batches(parse_movies, batches), hashes, batch_ends):
+                    movies_batch = [Movie(**fields, source_hash=row_hash) for fields, row_hash in zip(parsed, record_hashes)]
+                    if movies_batch:
+                        # recorded before the write, so a crash can only leave ids that are updated needlessly
+                        ids_file.writelines(f'{movie.movie_id}\n' for movie in movies_batch)
+                        ids_file.flush()
+                        self.write_batch(movies_batch)
+                        written += len(movies_batch)
+                    if checkpoint_path:
+                        self.write_checkpoint(checkpoint_path, {
+                            **checkpoint, 'rows': resumed_from + batch_end, 'written': checkpoint['written'] + written,
+                        })
+
+                rows_read += len(credits_chunk)
+                if checkpoint_path:
+                    self.write_checkpoint(checkpoint_path, {
+                        **checkpoint, 'rows': resumed_from + rows_read, 'written': checkpoint['written'] + written,
+                    })
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'Read {rows_read} rows, wrote {written} movies, {unchanged} unchanged ({rows_read / max(elapsed, 1e-6):.0f} rows/s)'
+                )
+        except BaseException:
+            ids_file.close()
+            if not checkpoint_path:  # nothing resumes from it
+                os.remove(ids_path)
+            raise
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        ids_file.close()
 
-
+        try:
+            # Tell the web workers to rebuild their catalogue indexes
+            if written or checkpoint['written']:
+                catalog.mark_changed(publish=True)
+
+            # Bring the written movies into similarity search without refitting the whole corpus,
+            # including those written before a resume, reading their ids back a chunk at a time
+            if not options['skip_index_update'] and (written or checkpoint['written']):
+                model = similarity.update_model(self.read_written_ids(ids_path))
+                if model is not None:
+                    self.stdout.write(f'Published TF-IDF model version {model.version}')
+        finally:
+            if not checkpoint_path:
+                os.remove(ids_path)
+
+        # The load finished, so the next run starts from the top again
+        if checkpoint_path:
+            for path in (checkpoint_path, ids_path):
+                if os.path.exists(path):
+                    os.remove(path)
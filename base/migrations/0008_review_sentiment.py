@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-17 20:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0007_alter_movie_budget_alter_movie_revenue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='sentiment',
+            field=models.FloatField(null=True),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0.6 on 2026-10-17 20:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+
+
+def populate_movie_stats(apps, schema_editor):
+    """Computes the stats of every rated or reviewed movie from the historical models."""
+    MovieStats = apps.get_model('base', 'MovieStats')
+    Rating = apps.get_model('base', 'Rating')
+    Review = apps.get_model('base', 'Review')
+
+    stats = {}
+    for row in Rating.objects.values('movie_id').annotate(count=Count('id'), total=Sum('rating')).iterator():
+        stats[row['movie_id']] = MovieStats(
+            movie_id=row['movie_id'], rating_count=row['count'], rating_sum=row['total'], rating_mean=row['total'] / row['count']
+        )
+    for row in Review.objects.values('movie_id').annotate(count=Count('id'), latest=Max('created_at')).iterator():
+        movie_stats = stats.setdefault(row['movie_id'], MovieStats(movie_id=row['movie_id']))
+        movie_stats.review_count = row['count']
+        movie_stats.latest_review_at = row['latest']
+    MovieStats.objects.bulk_create(stats.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0008_review_sentiment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovieStats',
+            fields=[
+                ('movie', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='base.movie')),
+                ('rating_count', models.IntegerField(default=0)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('rating_mean', models.FloatField(db_index=True, null=True)),
+                ('review_count', models.IntegerField(default=0)),
+                ('latest_review_at', models.DateTimeField(db_index=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(populate_movie_stats, migrations.RunPython.noop),
+    ]
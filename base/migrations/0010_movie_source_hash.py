@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-17 20:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0009_moviestats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='source_hash',
+            field=models.CharField(max_length=40, null=True),
+        ),
+    ]
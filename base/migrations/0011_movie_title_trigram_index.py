@@ -0,0 +1,30 @@
+# Trigram index for title search on PostgreSQL, see search.py.
+# Other databases search an in-memory index instead, so this migration does nothing there.
+
+from django.db import migrations
+
+
+def create_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # matches the UPPER(title::text) LIKE UPPER(...) that Django generates for title__icontains
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS base_movie_title_trgm ON base_movie USING gin ((UPPER(title::text)) gin_trgm_ops)'
+    )
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS base_movie_title_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0010_movie_source_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
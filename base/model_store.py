@@ -0,0 +1,123 @@
+# helper methods for storing recommendation models on disk
+# every build is written to its own version directory, and a CURRENT file names the published one,
+# so workers never read a half written model and can tell when a new one has been published
+
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+CURRENT_FILE = 'CURRENT'
+
+def model_root(name):
+    """Returns the directory holding every stored version of the named model."""
+    return os.path.join(settings.RECOMMENDER_MODEL_DIR, name)
+
+def new_version():
+    """Returns a version stamp that sorts in build order."""
+    return datetime.now().strftime('%Y%m%d%H%M%S%f')
+
+def version_dir(name, version):
+    """Returns the directory of one stored version of the named model."""
+    return os.path.join(model_root(name), version)
+
+def create_version_dir(name, version):
+    """Creates an empty directory for a new version of the named model."""
+    path = version_dir(name, version)
+    os.makedirs(path, exist_ok=False)
+    return path
+
+def current_version(name):
+    """Returns the published version of the named model, or None if nothing has been published."""
+    try:
+        with open(os.path.join(model_root(name), CURRENT_FILE)) as current_file:
+            return current_file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def publish(name, version, keep=3):
+    """Atomically marks a stored version as current and removes old versions beyond `keep`."""
+    root = model_root(name)
+    temp_path = os.path.join(root, f'{CURRENT_FILE}.{os.getpid()}.tmp')
+    with open(temp_path, 'w') as current_file:
+        current_file.write(version)
+    os.replace(temp_path, os.path.join(root, CURRENT_FILE))  # atomic on POSIX and Windows
+    prune(name, keep)
+
+def bump(name):
+    """Publishes a new version of `name` with no stored files, to signal a change to other processes."""
+    os.makedirs(model_root(name), exist_ok=True)
+    version = new_version()
+    publish(name, version)
+    return version
+
+def prune(name, keep=3):
+    """Removes all but the newest `keep` versions, never removing the published one."""
+    root = model_root(name)
+    published = current_version(name)
+    versions = sorted(entry for entry in os.listdir(root) if os.path.isdir(os.path.join(root, entry)))
+    for version in versions[:-keep] if keep else versions:
+        if version != published:
+            shutil.rmtree(os.path.join(root, version), ignore_errors=True)
+
+
+class PublishedModel:
+    """The published version of a stored model, loaded lazily once per process.
+
+    The CURRENT file is checked at most every settings.RECOMMENDER_MODEL_CHECK_INTERVAL seconds,
+    and a newer published version replaces the loaded one. `load` reads a version into a model with
+    a `version` attribute, or returns None if it cannot, in which case the previous model is kept and
+    that version is not tried again; `fallback`, if given, builds a model when nothing has been published.
+    """
+
+    def __init__(self, name, load, fallback=None):
+        self.name = name
+        self.model = None
+        self._load = load
+        self._fallback = fallback
+        self._checked = 0.0
+        self._unloadable = None # a published version `load` could not read
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns the loaded model, or None if nothing is published and there is no fallback."""
+        now = time.monotonic()
+        if self.model is not None and now - self._checked < settings.RECOMMENDER_MODEL_CHECK_INTERVAL:
+            return self.model
+
+        with self._lock:
+            self._checked = now
+            version = current_version(self.name)
+            if version is None:
+                if self.model is None and self._fallback is not None:
+                    self.model = self._fallback()
+            elif (self.model is None or self.model.version != version) and version != self._unloadable:
+                model = self._load(version)
+                if model is None:
+                    self._unloadable = version
+                else:
+                    self.model = model
+                    logger.info("Loaded %s model version %s", self.name, version)
+        return self.model
+
+    @property
+    def loaded(self):
+        """Whether a model has been loaded in this process, without loading one."""
+        return self.model is not None
+
+    def available(self):
+        """Whether get would return a model, i.e. a version is published or there is a fallback."""
+        return self.model is not None or self._fallback is not None or current_version(self.name) is not None
+
+    def reset(self):
+        """Forgets the loaded model so the next get reloads it."""
+        with self._lock:
+            self.model = None
+            self._checked = 0.0
+            self._unloadable = None
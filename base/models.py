@@ -29,10 +29,20 @@ class Movie(models.Model):
     spoken_languages = models.TextField(null=True)
     status = models.CharField(max_length=255, null=True)
     tagline	= models.TextField(null=True)
+    source_hash = models.CharField(max_length=40, null=True) # hash of the CSV rows the movie was written from, see movie_rows.source_hash
 
     def __str__(self):
         return self.title
 
+class MovieStats(models.Model):
+    # Denormalised rating and review totals, kept up to date by movie_stats.py
+    movie = models.OneToOneField('Movie', on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    rating_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    rating_mean = models.FloatField(null=True, db_index=True)
+    review_count = models.IntegerField(default=0)
+    latest_review_at = models.DateTimeField(null=True, db_index=True)
+
 class Rating(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     movie = models.ForeignKey('Movie', on_delete=models.CASCADE)
@@ -44,6 +54,7 @@ class Review(models.Model):
     movie = models.ForeignKey('Movie', on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
     review = models.TextField()
+    sentiment = models.FloatField(null=True) # review polarity from -1 to 1, set when the review is saved
     created_at = models.DateTimeField(auto_now_add=True)
 
 class Watchlist(models.Model):
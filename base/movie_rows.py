@@ -0,0 +1,149 @@
+# parsing of TMDB credits and movies CSV rows into Movie field values, used by the write_movies command
+# kept free of Django imports so write_movies --workers can run it in worker processes
+
+import hashlib
+import json
+import re
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# columns read from the movies CSV rows that credits rows join to, the credits CSV provides movie_id, title, cast and crew
+MOVIE_COLUMNS = [
+    'id', 'budget', 'homepage', 'original_language', 'overview', 'genres', 'keywords', 'production_companies',
+    'production_countries', 'release_date', 'revenue', 'runtime', 'spoken_languages', 'status', 'tagline',
+]
+# part of every source hash, bump it when parse_movie changes so the next load rewrites every movie
+PARSE_VERSION = 1
+
+def movie_positions(movie_ids):
+    """Maps each id in the movies file's id column to its data row, the last row when an id repeats."""
+    movie_ids = movie_ids.reset_index(drop=True)
+    movie_ids = movie_ids[~movie_ids.duplicated(keep='last')]
+    return pd.Series(movie_ids.index, index=movie_ids.to_numpy())
+
+def joined_rows(credits_df, positions):
+    """Returns the movies file data rows that a chunk of credits rows joins to."""
+    return set(positions.reindex(credits_df['movie_id'].unique()).dropna().astype(int).tolist())
+
+def movie_lookup(movies_df):
+    """Indexes movies file rows by id, keeping the last row of a repeated id."""
+    movies_df = movies_df[[column for column in MOVIE_COLUMNS if column in movies_df.columns]]
+    return movies_df.drop_duplicates('id', keep='last').set_index('id')
+
+def merge_chunk(credits_df, movies):
+    """Joins a chunk of credits rows to the movies lookup, dropping rows with no movie."""
+    merged_df = credits_df.join(movies, on='movie_id', how='inner')
+    return merged_df.drop_duplicates('movie_id', keep='last')
+
+def parse_movie(record):
+    """Builds the Movie field values for one merged credits and movies row, parsing each JSON cell once."""
+    cast = load_json(record.get('cast'))
+    crew = load_json(record.get('crew'))
+    movie_title = str(record['title'])
+
+    return {
+        'movie_id': int(record['movie_id']),
+        'title': movie_title,
+        'cleaned_title': clean_title(movie_title),
+        'actors': join_names(cast, 'name', empty=""),
+        'characters': join_names(cast, 'character', empty=""),
+        'director': crew_members(crew, 'Director'),
+        'writer': crew_members(crew, 'Writer'),
+        'composer': crew_members(crew, 'Composer'),
+        'composite_string': composite_string(movie_title, cast, crew),
+        'budget': to_int(record.get('budget')),
+        'homepage': to_python(record.get('homepage')),
+        'language': to_python(record.get('original_language')),
+        'overview': to_python(record.get('overview')),
+        'genres': join_names(load_json(record.get('genres'))),
+        'keywords': join_names(load_json(record.get('keywords'))),
+        'production_companies': join_names(load_json(record.get('production_companies'))),
+        'production_countries': join_names(load_json(record.get('production_countries'))),
+        'release_date': extract_release_date(record.get('release_date')),
+        'revenue': to_int(record.get('revenue')),
+        'runtime': to_int(record.get('runtime')),
+        'spoken_languages': join_names(load_json(record.get('spoken_languages'))),
+        'status': to_python(record.get('status')),
+        'tagline': to_python(record.get('tagline')),
+    }
+
+def source_hash(record):
+    """Returns a hash of a merged row's values, which changes whenever the source CSV rows change."""
+    values = {key: to_python(value) for key, value in record.items()}
+    encoded = json.dumps([PARSE_VERSION, values], sort_keys=True, default=str)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+def parse_movies(records):
+    """Parses a batch of merged rows, in order."""
+    return [parse_movie(record) for record in records]
+
+# removes unwanted characters from the movie title
+def clean_title(movie_title):
+    return re.sub("[^a-zA-Z0-9 ]", "", movie_title)
+
+# parse a JSON list cell, None when it is missing or not valid JSON
+def load_json(data):
+    try:
+        parsed = json.loads(data)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    return parsed if isinstance(parsed, list) else None
+
+# join one key of every parsed item with pipes, or return `empty` when there is nothing to join
+def join_names(items, key='name', empty=None):
+    try:
+        return "|".join(item[key] for item in items) if items else empty
+    except (KeyError, TypeError):
+        return empty
+
+# pipe delimited names of the crew with the given job, None when there are none
+def crew_members(crew, job_title):
+    try:
+        names = [member['name'] for member in crew or [] if member.get('job') == job_title]
+    except (KeyError, TypeError, AttributeError):
+        return None
+    return "|".join(names) if names else None
+
+# title, actors, characters, directors, writers and composers, cleaned and lower cased
+def composite_string(title, cast, crew):
+    def cleaned(names):
+        return [re.sub(r"[^a-zA-Z0-9 ]", "", name) for name in names.split("|") if name] if names else []
+
+    cleaned_components = [
+        clean_title(title),
+        *cleaned(join_names(cast, 'name', empty="")),
+        *cleaned(join_names(cast, 'character', empty="")),
+        *cleaned(crew_members(crew, 'Director')),
+        *cleaned(crew_members(crew, 'Writer')),
+        *cleaned(crew_members(crew, 'Composer')),
+    ]
+    return " ".join(cleaned_components).lower()
+
+# parse YYYY-MM-DD or dd/mm/yyyy dates
+def extract_release_date(date_string):
+    try:
+        if isinstance(date_string, str):
+            # First try parsing with the YYYY-MM-DD format
+            try:
+                return datetime.strptime(date_string, '%Y-%m-%d')
+            except ValueError:  # If it fails, try dd/mm/yyyy
+                return datetime.strptime(date_string, '%d/%m/%Y')
+        else:
+            raise ValueError(f"Expected string format, got: {date_string}")
+
+    except ValueError:  # Catch invalid date format
+        print(f"Invalid date format: {date_string}")
+        return None  # Or a default date if needed
+
+# pandas values as plain Python values, NaN as None
+def to_python(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+def to_int(value):
+    try:
+        return int(to_python(value))
+    except (ValueError, TypeError):
+        return None
@@ -0,0 +1,61 @@
+# materialised per-movie rating and review statistics
+# rating and review writes go through record_rating and record_review, which update the movie's
+# MovieStats row in the same transaction, so list pages can sort and display averages from an
+# indexed column instead of aggregating ratings on every request
+
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from .models import MovieStats, Rating, Review
+
+BATCH_SIZE = 1000
+
+def record_rating(user, movie, rating_value):
+    """Creates or updates a user's rating of a movie and the movie's stats together."""
+    with transaction.atomic():
+        stats = _locked_stats(movie)
+        previous = Rating.objects.filter(user=user, movie=movie).values_list('rating', flat=True).first()
+        rating, _ = Rating.objects.update_or_create(user=user, movie=movie, defaults={'rating': rating_value})
+
+        if previous is None:
+            stats.rating_count += 1
+            stats.rating_sum += rating_value
+        else:
+            stats.rating_sum += rating_value - previous
+        stats.rating_mean = stats.rating_sum / stats.rating_count
+        stats.save()
+    return rating
+
+def record_review(review):
+    """Saves a new review and updates its movie's stats together."""
+    with transaction.atomic():
+        stats = _locked_stats(review.movie)
+        review.save()
+        stats.review_count += 1
+        if stats.latest_review_at is None or review.created_at > stats.latest_review_at:
+            stats.latest_review_at = review.created_at
+        stats.save()
+    return review
+
+def rebuild_stats():
+    """Recomputes every movie's stats from the Rating and Review tables, returning how many movies have stats."""
+    stats = {}
+    rating_totals = Rating.objects.values('movie_id').annotate(count=Count('id'), total=Sum('rating'))
+    for row in rating_totals.iterator():
+        stats[row['movie_id']] = MovieStats(
+            movie_id=row['movie_id'], rating_count=row['count'], rating_sum=row['total'], rating_mean=row['total'] / row['count']
+        )
+    review_totals = Review.objects.values('movie_id').annotate(count=Count('id'), latest=Max('created_at'))
+    for row in review_totals.iterator():
+        movie_stats = stats.setdefault(row['movie_id'], MovieStats(movie_id=row['movie_id']))
+        movie_stats.review_count = row['count']
+        movie_stats.latest_review_at = row['latest']
+
+    with transaction.atomic():
+        MovieStats.objects.all().delete()
+        MovieStats.objects.bulk_create(stats.values(), batch_size=BATCH_SIZE)
+    return len(stats)
+
+def _locked_stats(movie):
+    """Returns a movie's stats row, creating it if needed, locked until the transaction ends."""
+    stats, _ = MovieStats.objects.select_for_update().get_or_create(movie=movie)
+    return stats
@@ -0,0 +1,77 @@
+# query counting for views
+# QueryBudgetMiddleware logs every request whose view runs more than settings.QUERY_BUDGET database queries,
+# so an N+1 loop introduced in a template shows up in the logs before it shows up as a slow page;
+# assert_query_budget is the same check for tests, failing with the offending SQL
+
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCounter:
+    """A database execute wrapper recording the SQL and duration of every query it sees."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.monotonic() - started))
+
+    def __len__(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        return sum(duration for _, duration in self.queries)
+
+
+@contextmanager
+def count_queries():
+    """Counts the queries run on every database connection inside the block."""
+    counter = QueryCounter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+        yield counter
+
+@contextmanager
+def assert_query_budget(budget):
+    """Fails with the SQL that was run if the block runs more than `budget` queries.
+
+    Unlike TestCase.assertNumQueries it allows fewer, so it can guard a page whose query count
+    may drop but must not grow with the number of rows it shows.
+    """
+    with count_queries() as counter:
+        yield counter
+    if len(counter) > budget:
+        statements = '\n'.join(f'{number}. {sql}' for number, (sql, _) in enumerate(counter.queries, start=1))
+        raise AssertionError(f'{len(counter)} queries run, the budget is {budget}:\n{statements}')
+
+
+class QueryBudgetMiddleware:
+    """Logs a warning for every request that runs more than settings.QUERY_BUDGET queries (0 disables it)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.QUERY_BUDGET:
+            return self.get_response(request)
+        with count_queries() as counter:
+            response = self.get_response(request)
+        if len(counter) > settings.QUERY_BUDGET:
+            match = request.resolver_match
+            logger.warning(
+                "%s ran %d queries (%.0f ms), over the budget of %d: %s %s",
+                match.view_name if match else 'unresolved view', len(counter), counter.duration * 1000,
+                settings.QUERY_BUDGET, request.method, request.path,
+            )
+        return response
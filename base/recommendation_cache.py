@@ -0,0 +1,111 @@
+# per-process cache of movie_search recommendations, so repeat searches for popular titles skip the similarity
+# scoring and collaborative reranking. The anonymous tier holds each movie's similar movie_ids per TF-IDF
+# model version; the personalised tier holds a user's reranked list per movie and per version of that user's
+# ratings. The version lives in Django's cache, so a rating saved by one process (see signals.py) only retires
+# the list in every process when CACHE_URL names a shared backend; with the default local memory cache, other
+# workers keep serving it until it expires (see the check below and RECOMMENDATION_CACHE_TIMEOUT)
+
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+
+RATING_VERSION_KEY = 'recommendations:rating_version:{user_id}'
+
+
+class LruCache:
+    """A bounded mapping that evicts the least recently used entry, with hit and miss counters.
+
+    Entries older than `timeout` seconds count as misses; a timeout of 0 keeps them until they are evicted.
+    """
+
+    def __init__(self, max_size, timeout=0):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached value, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.timeout and time.monotonic() - entry[1] > self.timeout:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached value, computing and caching it on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def stats(self):
+        """Returns the size and hit counters, for the readiness endpoint."""
+        lookups = self.hits + self.misses
+        return {'size': len(self._entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+# (movie_id, candidates, model version) -> similar movie_ids, best first
+similar_movies = LruCache(settings.RECOMMENDATION_CACHE_SIZE)
+# (user_id, movie_id, top_n, model version, rating version) -> reranked movie_ids; collaborative scores also
+# move with other users' ratings, so these expire after settings.RECOMMENDATION_CACHE_TIMEOUT
+user_recommendations = LruCache(settings.RECOMMENDATION_USER_CACHE_SIZE, settings.RECOMMENDATION_CACHE_TIMEOUT)
+
+def rating_version(user_id):
+    """Returns the version of a user's ratings, which changes whenever they rate or unrate a movie."""
+    # a fresh version after an eviction, so entries cached under the evicted one are never served again
+    return cache.get_or_set(RATING_VERSION_KEY.format(user_id=user_id), time.time_ns, timeout=None)
+
+def bump_rating_version(user_id):
+    """Retires every cached personalised recommendation of the user, in every process."""
+    key = RATING_VERSION_KEY.format(user_id=user_id)
+    try:
+        cache.incr(key)
+    except ValueError:  # not cached yet, or evicted
+        cache.set(key, time.time_ns(), timeout=None)
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """Warns when rating versions and the ratings stamp are kept in a cache each worker process has its own copy of."""
+    if settings.CACHES['default']['BACKEND'] != 'django.core.cache.backends.locmem.LocMemCache':
+        return []
+    return [checks.Warning(
+        'The default cache is local to each process, so a rating only refreshes personalised recommendations '
+        'and the rating matrix in the worker that saved it; other workers serve old recommendations for up to '
+        'RECOMMENDATION_CACHE_TIMEOUT seconds and never reload their rating matrix.',
+        hint='Set CACHE_URL to a shared cache such as redis:// or memcache://.',
+        id='base.W001',
+    )]
+
+def stats():
+    """Returns the counters of both tiers."""
+    return {'similar_movies': similar_movies.stats(), 'user_recommendations': user_recommendations.stats()}
+
+def clear():
+    similar_movies.clear()
+    user_recommendations.clear()
@@ -0,0 +1,29 @@
+# random movie sampling for the homepage
+# keeps every movie_id in memory (refreshed when the catalogue changes) and draws from it with NumPy,
+# so picking random movies is one movie_id__in query instead of an ORDER BY RANDOM() per movie
+
+import numpy as np
+from .models import Movie
+from .catalog import CatalogIndex
+
+def _load_movie_ids():
+    return np.fromiter(Movie.objects.values_list('movie_id', flat=True), dtype=np.int64)
+
+movie_ids = CatalogIndex(_load_movie_ids)
+_rng = np.random.default_rng()
+
+def sample_movie_ids(count, exclude=()):
+    """Returns up to `count` distinct random movie_ids, none of them in `exclude`."""
+    ids = movie_ids.get()
+    exclude = set(exclude)
+    size = min(count + len(exclude), len(ids))
+    if count <= 0 or size <= 0:
+        return []
+    sampled = ids[_rng.choice(len(ids), size=size, replace=False)] # O(size), not O(catalogue)
+    return [movie_id for movie_id in sampled.tolist() if movie_id not in exclude][:count]
+
+def random_movies(count, exclude=()):
+    """Returns up to `count` distinct random movies, none of them with a movie_id in `exclude`."""
+    sampled = sample_movie_ids(count, exclude)
+    movies = Movie.objects.in_bulk(sampled)
+    return [movies[movie_id] for movie_id in sampled if movie_id in movies]
@@ -0,0 +1,255 @@
+# movie title search used by views.general_search
+# on PostgreSQL the title is matched through a pg_trgm index (see migration 0011) and ranked by trigram similarity;
+# elsewhere each worker keeps a trigram inverted index of every title in memory, rebuilt when the catalogue changes,
+# so a search intersects a few posting lists instead of scanning the table with LIKE '%x%'.
+# Typeahead completions always come from an in-memory sorted array of cleaned titles, and typed titles
+# are resolved to a movie by shortlisting on shared trigrams, then ranking the shortlist by edit distance
+
+import re
+from bisect import bisect_left
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Value, When
+from .models import Movie
+from .catalog import CatalogIndex
+
+# rank tiers, best first
+EXACT, PREFIX, WORD_PREFIX, SUBSTRING = range(4)
+
+
+class TitleIndex:
+    """Every movie title lower cased, with a posting list of title rows per trigram and per word."""
+
+    def __init__(self, movie_ids, titles):
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        self.titles = titles
+        self.lengths = np.asarray([len(title) for title in titles], dtype=np.int32)
+        trigrams = {}
+        words = {}
+        for row, title in enumerate(titles):
+            for trigram in _trigrams(title):
+                trigrams.setdefault(trigram, []).append(row)
+            for word in set(title.split()):
+                words.setdefault(word, []).append(row)
+        self.trigrams = {trigram: np.asarray(rows, dtype=np.int32) for trigram, rows in trigrams.items()}
+        # sorted words, so the words starting with a prefix are one contiguous slice
+        self.words = sorted(words)
+        self.word_rows = [np.asarray(words[word], dtype=np.int32) for word in self.words]
+
+    def candidates(self, query):
+        """Returns the rows whose title might contain `query`, a superset of the real matches."""
+        query_trigrams = _trigrams(query)
+        if query_trigrams:
+            postings = sorted((self.trigrams.get(trigram) for trigram in query_trigrams), key=lambda rows: 0 if rows is None else len(rows))
+            if postings[0] is None:
+                return np.empty(0, dtype=np.int32)
+            rows = postings[0]
+            for other in postings[1:]:
+                rows = np.intersect1d(rows, other, assume_unique=True)
+            return rows
+        # one or two characters have no trigram, so match them as the start of a word
+        return self.word_prefix_rows(query)
+
+    def word_prefix_rows(self, prefix):
+        """Returns the rows whose title has a word starting with `prefix`."""
+        start = bisect_left(self.words, prefix)
+        end = bisect_left(self.words, prefix + '\uffff')
+        if start == end:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate(self.word_rows[start:end]))
+
+    def shortlist(self, query, rows, max_candidates):
+        """Cuts `rows` down to `max_candidates`, keeping the ones most likely to rank first.
+
+        Only titles with a word starting like the query can be exact, prefix or word prefix matches,
+        so those come first, then the other candidates; within each, shorter titles rank first.
+        """
+        leading = np.intersect1d(rows, self.word_prefix_rows(query.split()[0]), assume_unique=True)
+        leading = self._shortest(leading, max_candidates)
+        others = self._shortest(np.setdiff1d(rows, leading, assume_unique=True), max_candidates - len(leading))
+        return np.concatenate([leading, others])
+
+    def _shortest(self, rows, count):
+        if len(rows) <= count:
+            return rows
+        if count <= 0:
+            return rows[:0]
+        return rows[np.argpartition(self.lengths[rows], count - 1)[:count]]
+
+    def search(self, query, limit, max_candidates=None):
+        """Returns the movie_ids of up to `limit` titles containing `query`, best match first.
+
+        At most `max_candidates` candidate titles are ranked, so a short, common query costs the same as a rare one.
+        """
+        rows = self.candidates(query)
+        if max_candidates is not None and len(rows) > max_candidates:
+            rows = self.shortlist(query, rows, max_candidates)
+        ranked = []
+        for row in rows.tolist():
+            title = self.titles[row]
+            if query not in title:
+                continue
+            if title == query:
+                tier = EXACT
+            elif title.startswith(query):
+                tier = PREFIX
+            elif f' {query}' in title:
+                tier = WORD_PREFIX
+            else:
+                tier = SUBSTRING
+            ranked.append((tier, len(title), title, row))
+        ranked.sort()
+        return self.movie_ids[[row for *_, row in ranked[:limit]]].tolist()
+
+
+class CompletionIndex:
+    """Every normalised cleaned_title in sorted order, so the titles starting with a prefix are one contiguous slice."""
+
+    def __init__(self, rows):
+        rows = sorted((normalise_title(cleaned_title), title, movie_id) for movie_id, title, cleaned_title in rows)
+        self.keys = [key for key, _, _ in rows]
+        self.completions = [{'movie_id': movie_id, 'title': title} for _, title, movie_id in rows]
+
+    def complete(self, prefix, limit):
+        """Returns up to `limit` {'movie_id', 'title'} dicts whose cleaned title starts with `prefix`, alphabetically."""
+        prefix = normalise_title(prefix)
+        if not prefix:
+            return []
+        start = bisect_left(self.keys, prefix)
+        end = min(bisect_left(self.keys, prefix + '\uffff'), start + limit)
+        return self.completions[start:end]
+
+
+class TitleResolution:
+    """The movie a typed title most likely means, or None, and the next closest titles as {'movie_id', 'title'} dicts."""
+
+    def __init__(self, movie_id=None, title=None, alternatives=()):
+        self.movie_id = movie_id
+        self.title = title
+        self.alternatives = list(alternatives)
+
+
+class FuzzyTitleIndex:
+    """Every normalised cleaned_title with a posting list of title rows per character trigram, for typo tolerant lookup."""
+
+    def __init__(self, rows):
+        rows = list(rows)
+        self.movie_ids = np.asarray([movie_id for movie_id, _, _ in rows], dtype=np.int64)
+        self.titles = [title for _, title, _ in rows]
+        self.keys = [normalise_title(cleaned_title) for _, _, cleaned_title in rows]
+        postings = {}
+        gram_counts = []
+        for row, key in enumerate(self.keys):
+            grams = _padded_trigrams(key)
+            gram_counts.append(len(grams))
+            for gram in grams:
+                postings.setdefault(gram, []).append(row)
+        self.postings = {gram: np.asarray(rows, dtype=np.int32) for gram, rows in postings.items()}
+        self.gram_counts = np.asarray(gram_counts, dtype=np.float64)
+
+    def shortlist(self, key, size):
+        """Returns the rows of the `size` titles sharing the most trigrams with `key`, by Dice coefficient."""
+        grams = _padded_trigrams(key)
+        found = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        shared = np.bincount(np.concatenate(found), minlength=len(self.keys))
+        candidates = np.flatnonzero(shared)
+        dice = 2 * shared[candidates] / (len(grams) + self.gram_counts[candidates])
+        if len(candidates) > size:
+            keep = np.argpartition(-dice, size - 1)[:size]
+            candidates, dice = candidates[keep], dice[keep]
+        return candidates[np.argsort(-dice, kind='stable')]
+
+    def resolve(self, query, alternatives, max_distance):
+        """Ranks the shortlisted titles by edit distance to `query`; the best is the match if it is close enough."""
+        key = normalise_title(query)
+        if not key:
+            return TitleResolution()
+        ranked = sorted(
+            (edit_distance(key, self.keys[row]), len(self.keys[row]), self.keys[row], row)
+            for row in self.shortlist(key, settings.TITLE_RESOLVER_SHORTLIST).tolist()
+        )
+        closest = [{'movie_id': int(self.movie_ids[row]), 'title': self.titles[row]} for *_, row in ranked]
+        if not ranked or ranked[0][0] > max_distance * max(len(key), ranked[0][1]):
+            return TitleResolution(alternatives=closest[:alternatives])
+        return TitleResolution(closest[0]['movie_id'], closest[0]['title'], closest[1:alternatives + 1])
+
+
+def edit_distance(first, second):
+    """Returns the Levenshtein distance between two strings."""
+    if len(first) < len(second):
+        first, second = second, first
+    previous = list(range(len(second) + 1))
+    for row, first_char in enumerate(first, start=1):
+        current = [row]
+        for column, second_char in enumerate(second, start=1):
+            current.append(min(previous[column] + 1, current[column - 1] + 1, previous[column - 1] + (first_char != second_char)))
+        previous = current
+    return previous[-1]
+
+def normalise_title(title):
+    """Lower cases a title and drops everything but letters, digits and single spaces."""
+    return ' '.join(re.sub('[^a-z0-9 ]', ' ', (title or '').lower()).split())
+
+def _trigrams(text):
+    return {text[start:start + 3] for start in range(len(text) - 2)}
+
+def _padded_trigrams(key):
+    # padding gives the first and last characters trigrams of their own, so short titles still match
+    return _trigrams(f'  {key} ')
+
+def _build_title_index():
+    rows = Movie.objects.order_by('movie_id').values_list('movie_id', 'title')
+    movie_ids, titles = [], []
+    for movie_id, title in rows.iterator(chunk_size=10000):
+        movie_ids.append(movie_id)
+        titles.append(' '.join((title or '').lower().split()))
+    return TitleIndex(movie_ids, titles)
+
+title_index = CatalogIndex(_build_title_index)
+
+def _build_completion_index():
+    return CompletionIndex(Movie.objects.values_list('movie_id', 'title', 'cleaned_title').iterator(chunk_size=10000))
+
+completion_index = CatalogIndex(_build_completion_index)
+
+def _build_fuzzy_title_index():
+    return FuzzyTitleIndex(Movie.objects.values_list('movie_id', 'title', 'cleaned_title').iterator(chunk_size=10000))
+
+fuzzy_title_index = CatalogIndex(_build_fuzzy_title_index)
+
+def search_movie_ids(query, limit=None):
+    """Returns the movie_ids of movies whose title contains `query`, ranked exact match, prefix, word prefix, then anywhere."""
+    query = ' '.join(query.lower().split())
+    limit = limit or settings.SEARCH_MAX_RESULTS
+    if not query:
+        return []
+    if connection.vendor == 'postgresql':
+        return _search_postgres(query, limit)
+    return title_index.get().search(query, limit, max(limit, settings.SEARCH_MAX_CANDIDATES))
+
+def _search_postgres(query, limit):
+    from django.contrib.postgres.search import TrigramSimilarity
+
+    matches = Movie.objects.filter(title__icontains=query).annotate(
+        tier=Case(
+            When(title__iexact=query, then=Value(EXACT)),
+            When(title__istartswith=query, then=Value(PREFIX)),
+            When(title__icontains=f' {query}', then=Value(WORD_PREFIX)),
+            default=Value(SUBSTRING),
+            output_field=IntegerField(),
+        ),
+        similarity=TrigramSimilarity('title', query),
+    )
+    return list(matches.order_by('tier', '-similarity', 'title').values_list('movie_id', flat=True)[:limit])
+
+def complete_titles(prefix, limit=None):
+    """Returns typeahead completions for `prefix` from this worker's in-memory index, without a query once it is built."""
+    limit = min(limit or settings.AUTOCOMPLETE_LIMIT, settings.AUTOCOMPLETE_LIMIT)
+    return completion_index.get().complete(prefix, limit)
+
+def resolve_title(query, alternatives=5):
+    """Returns the TitleResolution of a typed, possibly misspelt, movie title."""
+    return fuzzy_title_index.get().resolve(query, alternatives, settings.TITLE_RESOLVER_MAX_DISTANCE)
@@ -0,0 +1,45 @@
+# cached homepage sections
+# the sections are read from the materialised MovieStats rows (see movie_stats.py) and kept in Django's
+# cache until a Rating or Review write invalidates them (see signals.py), so most homepage hits never
+# touch the rating tables, and the rest are an indexed sort with no GROUP BY
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from .models import Movie
+
+TOP_RATED_KEY = 'homepage:top_rated'
+RECENTLY_REVIEWED_KEY = 'homepage:recently_reviewed'
+SECTION_SIZE = 10
+
+def top_rated_films():
+    """Returns the highest rated films, each with an avg_rating."""
+    films = cache.get(TOP_RATED_KEY)
+    if films is None:
+        films = list(
+            Movie.objects.filter(stats__rating_mean__isnull=False)
+            .annotate(avg_rating=F('stats__rating_mean'))
+            .order_by('-stats__rating_mean', 'movie_id')[:SECTION_SIZE]
+        )
+        cache.set(TOP_RATED_KEY, films, settings.HOMEPAGE_SECTION_TIMEOUT)
+    return films
+
+def recently_reviewed_movies():
+    """Returns the most recently reviewed films, each with an avg_rating and latest_review time."""
+    movies = cache.get(RECENTLY_REVIEWED_KEY)
+    if movies is None:
+        movies = list(
+            Movie.objects.filter(stats__latest_review_at__isnull=False)
+            .annotate(avg_rating=F('stats__rating_mean'), latest_review=F('stats__latest_review_at'))
+            .order_by('-stats__latest_review_at')[:SECTION_SIZE]
+        )
+        cache.set(RECENTLY_REVIEWED_KEY, movies, settings.HOMEPAGE_SECTION_TIMEOUT)
+    return movies
+
+def invalidate_ratings():
+    """Forgets every section that shows average ratings."""
+    cache.delete_many([TOP_RATED_KEY, RECENTLY_REVIEWED_KEY])
+
+def invalidate_reviews():
+    """Forgets every section that depends on reviews."""
+    cache.delete(RECENTLY_REVIEWED_KEY)
@@ -0,0 +1,13 @@
+# review sentiment scoring
+# kept free of Django imports so the backfill_review_sentiment command can run it in worker processes
+
+from textblob import TextBlob
+
+
+def polarity(review_text):
+    """Analyses review sentiment based on a review's content, from -1 (negative) to 1 (positive)."""
+    return TextBlob(review_text or '').sentiment.polarity
+
+def polarities(review_texts):
+    """Scores a batch of reviews."""
+    return [polarity(review_text) for review_text in review_texts]
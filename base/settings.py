@@ -47,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'base.query_budget.QueryBudgetMiddleware',  # first, so every query of the request is counted
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -57,6 +58,9 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Database queries a request may run before QueryBudgetMiddleware logs a warning, 0 to stop counting
+QUERY_BUDGET = env.int('QUERY_BUDGET', default=20)
+
 ROOT_URLCONF = 'base.urls'
 
 TEMPLATES = [
@@ -94,6 +98,18 @@ DATABASES = {
 # }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Local memory by default; set CACHE_URL (e.g. redis://...) so invalidations reach every worker
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+# Seconds a cached homepage section lives if no rating or review write invalidates it first
+HOMEPAGE_SECTION_TIMEOUT = env.int('HOMEPAGE_SECTION_TIMEOUT', default=300)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -138,3 +154,82 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
+
+# Recommendation models
+# Fitted models are published here by the build_* management commands and loaded lazily by each worker
+
+RECOMMENDER_MODEL_DIR = env('RECOMMENDER_MODEL_DIR', default=os.path.join(BASE_DIR, 'recommender_models'))
+
+# Seconds between checks for a newly published model version
+RECOMMENDER_MODEL_CHECK_INTERVAL = env.int('RECOMMENDER_MODEL_CHECK_INTERVAL', default=30)
+
+# Share of out of vocabulary n-grams in incrementally added movies that triggers a full TF-IDF refit
+SIMILARITY_REFIT_DRIFT = env.float('SIMILARITY_REFIT_DRIFT', default=0.2)
+
+# Weight of each field's TF-IDF cosine similarity in a movie's similarity score, e.g.
+# SIMILARITY_FIELD_WEIGHTS=composite_string=1,genres=0.5 - changes apply without refitting,
+# but the precomputed neighbour table is only used while the weights match the ones it was built with
+SIMILARITY_FIELD_WEIGHTS = env.dict('SIMILARITY_FIELD_WEIGHTS', cast={'value': float}, default={
+    'composite_string': 1.0,
+    'genres': 0.5,
+    'keywords': 0.5,
+    'overview': 0.3,
+    'production_companies': 0.2,
+})
+
+# Vocabulary pruning for each TF-IDF field: terms in fewer than SIMILARITY_MIN_DF movies are dropped, and only
+# the SIMILARITY_MAX_FEATURES most frequent terms are kept (0 keeps them all). A term in a single movie never
+# makes two movies similar, so SIMILARITY_MIN_DF=2 shrinks large catalogues at almost no cost
+SIMILARITY_MIN_DF = env.int('SIMILARITY_MIN_DF', default=1)
+SIMILARITY_MAX_FEATURES = env.int('SIMILARITY_MAX_FEATURES', default=500000)
+
+# Similar movies precomputed per movie by build_tfidf, 0 to score every search against the whole matrix
+SIMILARITY_NEIGHBOURS = env.int('SIMILARITY_NEIGHBOURS', default=100)
+# Memory the dense scores of one block of rows may take while the neighbour table is built; blocks shrink as the
+# catalogue grows, to 16 rows at 1M movies with the default
+SIMILARITY_NEIGHBOUR_MEMORY_MB = env.int('SIMILARITY_NEIGHBOUR_MEMORY_MB', default=256)
+
+# Co-liked movies kept per movie by build_item_similarity
+ITEM_SIMILARITY_NEIGHBOURS = env.int('ITEM_SIMILARITY_NEIGHBOURS', default=50)
+
+# Seconds between checks for catalogue changes made by other processes (e.g. write_movies)
+CATALOG_CHECK_INTERVAL = env.int('CATALOG_CHECK_INTERVAL', default=30)
+
+# Seconds a worker keeps its rating matrix before reloading it, when ratings changed meanwhile
+RATING_MATRIX_REFRESH_INTERVAL = env.int('RATING_MATRIX_REFRESH_INTERVAL', default=300)
+
+# Search
+# Most ranked matches a title search returns, and the matches shown per results page
+
+SEARCH_MAX_RESULTS = env.int('SEARCH_MAX_RESULTS', default=500)
+SEARCH_PAGE_SIZE = env.int('SEARCH_PAGE_SIZE', default=20)
+# Most candidate titles the in-memory title index ranks per search, never fewer than the results asked for
+SEARCH_MAX_CANDIDATES = env.int('SEARCH_MAX_CANDIDATES', default=2000)
+
+# Most completions the autocomplete endpoint returns per keystroke
+AUTOCOMPLETE_LIMIT = env.int('AUTOCOMPLETE_LIMIT', default=10)
+
+# Titles shortlisted by shared trigrams before the title resolver ranks them by edit distance,
+# and the largest edit distance, as a share of the title length, still accepted as a match
+TITLE_RESOLVER_SHORTLIST = env.int('TITLE_RESOLVER_SHORTLIST', default=50)
+TITLE_RESOLVER_MAX_DISTANCE = env.float('TITLE_RESOLVER_MAX_DISTANCE', default=0.4)
+
+# Entries in each worker's movie_search recommendation cache: similar movies per movie, and reranked
+# recommendations per signed in user and movie, which also expire after RECOMMENDATION_CACHE_TIMEOUT seconds.
+# A user's rating retires their reranked lists in every worker only with a shared CACHE_URL (check base.W001);
+# with the local memory default, the other workers serve them until this timeout
+RECOMMENDATION_CACHE_SIZE = env.int('RECOMMENDATION_CACHE_SIZE', default=10000)
+RECOMMENDATION_USER_CACHE_SIZE = env.int('RECOMMENDATION_USER_CACHE_SIZE', default=10000)
+RECOMMENDATION_CACHE_TIMEOUT = env.int('RECOMMENDATION_CACHE_TIMEOUT', default=600)
+
+# Most movies the JSON recommendation API accepts in one request
+RECOMMENDATION_API_MAX_BATCH = env.int('RECOMMENDATION_API_MAX_BATCH', default=1000)
+
+# Content similarity backend: 'exact' scores every movie, 'ivf' only scores the movies in the query's
+# closest partitions of the index built by build_ann_index (falling back to exact until one is built)
+SIMILARITY_BACKEND = env('SIMILARITY_BACKEND', default='exact')
+ANN_COMPONENTS = env.int('ANN_COMPONENTS', default=128)
+ANN_LISTS = env.int('ANN_LISTS', default=0)
+# Partitions searched per query, the recall/latency knob; candidates rescored exactly per requested neighbour
+ANN_NPROBE = env.int('ANN_NPROBE', default=8)
+ANN_CANDIDATES = env.int('ANN_CANDIDATES', default=4)
@@ -0,0 +1,43 @@
+# This file connects model signals to the helpers that keep derived data up to date.
+# It is imported by BaseConfig.ready so the receivers are registered once at startup.
+
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Movie, Rating, Review
+from . import sentiment, sections, catalog, recommendation_cache, collaborative
+
+@receiver(pre_save, sender=Review)
+def score_review_sentiment(sender, instance, update_fields=None, **kwargs):
+    """Scores a review's sentiment when it is saved, so it never has to be scored on the request path."""
+    if update_fields is None or 'review' in update_fields:
+        instance.sentiment = sentiment.polarity(instance.review)
+
+@receiver([post_save, post_delete], sender=Rating)
+def invalidate_rating_sections(sender, **kwargs):
+    """Recomputes the cached homepage sections once a rating change is committed.
+
+    Invalidating any earlier would let a concurrent request re-cache the stats from before the change.
+    """
+    transaction.on_commit(sections.invalidate_ratings)
+
+@receiver([post_save, post_delete], sender=Rating)
+def mark_ratings_changed(sender, **kwargs):
+    """Lets every process rebuild its rating matrix, at its next check, once the rating is committed."""
+    transaction.on_commit(collaborative.ratings_stamp.mark_changed)
+
+@receiver([post_save, post_delete], sender=Rating)
+def invalidate_user_recommendations(sender, instance, **kwargs):
+    """Retires the user's cached personalised recommendations once their rating change is committed."""
+    user_id = instance.user_id
+    transaction.on_commit(lambda: recommendation_cache.bump_rating_version(user_id))
+
+@receiver([post_save, post_delete], sender=Review)
+def invalidate_review_sections(sender, **kwargs):
+    """Recomputes the cached homepage sections once a review change is committed."""
+    transaction.on_commit(sections.invalidate_reviews)
+
+@receiver([post_save, post_delete], sender=Movie)
+def mark_catalog_changed(sender, **kwargs):
+    """Rebuilds this process's catalogue indexes after a movie changes."""
+    catalog.mark_changed()
@@ -0,0 +1,543 @@
+# content similarity engine used by utils.find_similar_movies
+# a movie's similarity to another is the weighted sum of the cosine similarities of their TF-IDF vectors
+# for each of FIELDS, weighted by settings.SIMILARITY_FIELD_WEIGHTS
+# the TF-IDF model is fit once (see the build_tfidf command), stored with model_store,
+# and loaded lazily once per worker process, reloading whenever a newer version is published
+
+import json
+import logging
+import os
+from collections import Counter
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+from .models import Movie
+from . import model_store, ann
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = 'tfidf'
+MODEL_FORMAT = 2 # bump when the stored layout changes, older versions are not loaded until build_tfidf refits
+NGRAM_RANGE = (1, 2) # finds similarities for one and two word groups
+NEIGHBOUR_BLOCK_SIZE = 1024 # most rows scored per sparse product when building the neighbour table
+UPDATE_CHUNK_SIZE = 500 # movies fetched per query by update_model, well under SQLite's limit on bound parameters
+SCORE_BYTES = 16 # bytes held per dense score while a block is ranked: the float32 scores, their negation and argpartition's int64 indices
+
+def _split_pipes(text):
+    return [value.strip() for value in text.split('|') if value.strip()]
+
+# Movie fields with a TF-IDF matrix of their own, and how each is tokenised.
+# Pipe delimited lists are matched on whole values, so "Science Fiction" only matches itself
+FIELDS = {
+    'composite_string': {'ngram_range': NGRAM_RANGE},
+    'genres': {'tokenizer': _split_pipes, 'token_pattern': None},
+    'keywords': {'tokenizer': _split_pipes, 'token_pattern': None},
+    'overview': {'stop_words': 'english'},
+    'production_companies': {'tokenizer': _split_pipes, 'token_pattern': None},
+}
+
+def field_weights():
+    """Returns the weight of each field's cosine similarity in a movie's score, from settings.SIMILARITY_FIELD_WEIGHTS."""
+    return {field: float(settings.SIMILARITY_FIELD_WEIGHTS.get(field, 0)) for field in FIELDS}
+
+
+class FieldVectorizer:
+    """A fitted TF-IDF vectorizer for one field, whose vocabulary is a sorted array of UTF-8 terms.
+
+    Term i is matrix column i, so looking terms up is a binary search over an array that
+    load_model memory maps, rather than a dict of every term in each worker's heap.
+    Transforms like TfidfVectorizer: raw term counts times idf, L2 normalised, as float32.
+    `min_df` is how many movies a term outside the vocabulary must be in for a refit to keep it.
+    """
+
+    def __init__(self, field, terms, idf, min_df=1):
+        self.field = field
+        self.terms = terms
+        self.idf = idf
+        self.min_df = min_df
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        return bool(self.columns([term])[0] >= 0)
+
+    def build_analyzer(self):
+        return TfidfVectorizer(**FIELDS[self.field]).build_analyzer()
+
+    def columns(self, terms):
+        """Returns the column of each term, or -1 for terms outside the vocabulary."""
+        if not len(self.terms) or not len(terms):
+            return np.full(len(terms), -1, dtype=np.int64)
+        encoded = [term.encode('utf-8') for term in terms]
+        width = self.terms.dtype.itemsize
+        keys = np.asarray([term if len(term) <= width else b'' for term in encoded], dtype=self.terms.dtype)
+        positions = np.minimum(np.searchsorted(self.terms, keys), len(self.terms) - 1)
+        found = (self.terms[positions] == keys) & (keys != b'')
+        return np.where(found, positions, -1)
+
+    def transform(self, documents):
+        """Returns the L2 normalised TF-IDF rows of `documents` as a float32 CSR matrix."""
+        analyzer = self.build_analyzer()
+        row_terms = [analyzer(document or '') for document in documents]
+        rows = np.repeat(np.arange(len(documents)), [len(terms) for terms in row_terms])
+        columns = self.columns([term for terms in row_terms for term in terms])
+        known = columns >= 0
+        counts = sparse.csr_matrix(
+            (np.ones(int(known.sum()), dtype=np.float32), (rows[known], columns[known])), shape=(len(documents), len(self.terms))
+        )
+        counts.sum_duplicates()
+        return normalize(counts @ sparse.diags(np.asarray(self.idf, dtype=np.float32))).astype(np.float32).tocsr()
+
+
+def compact_vectorizer(field, vectorizer, matrix):
+    """Converts a fitted TfidfVectorizer and its matrix into a FieldVectorizer with columns in term order."""
+    terms = np.asarray([term.encode('utf-8') for term in vectorizer.get_feature_names_out()], dtype=bytes)
+    order = np.argsort(terms, kind='stable')
+    min_df = vectorizer.min_df
+    if vectorizer.max_features and len(terms) >= vectorizer.max_features:
+        # the vocabulary was cut to max_features, so a new term also has to be as common as the rarest kept one,
+        # whose document frequency the smooth idf gives back: idf = ln((1 + n) / (1 + df)) + 1
+        rarest = (1 + matrix.shape[0]) / np.exp(vectorizer.idf_.max() - 1) - 1
+        min_df = max(min_df, int(np.round(rarest)))
+    return FieldVectorizer(field, terms[order], vectorizer.idf_[order].astype(np.float32), min_df), matrix[:, order]
+
+
+class TfidfModel:
+    """A fitted TF-IDF vectorizer per non-empty field, their matrices side by side, and the movie_id of every matrix row.
+
+    `movie_ids[row]` is the movie in a matrix row and `row_index[movie_id]` is the reverse,
+    so the model never relies on the order the database happens to return movies in.
+    Each field's rows are L2 normalised, so scoring a query whose columns are scaled by
+    `column_weights()` gives the weighted sum of the per-field cosine similarities in one product,
+    and the weights can change without refitting.
+    """
+
+    def __init__(self, vectorizers, matrix, movie_ids, version=None, oov_terms=0, total_terms=0,
+                 neighbour_ids=None, neighbour_scores=None, fit_version=None, neighbour_weights=None):
+        self.vectorizers = vectorizers
+        self.matrix = matrix
+        self.movie_ids = movie_ids
+        self.row_index = build_row_index(movie_ids)
+        self.version = version
+        # version of the last full fit, which incremental updates keep along with its vocabulary
+        self.fit_version = fit_version
+        # each row's most similar movie_ids and their scores, best first, under `neighbour_weights` (see compute_neighbours)
+        self.neighbour_ids = neighbour_ids
+        self.neighbour_scores = neighbour_scores
+        self.neighbour_weights = neighbour_weights
+        # n-grams seen in documents transformed since the last full fit, and how many were out of vocabulary
+        self.oov_terms = oov_terms
+        self.total_terms = total_terms
+
+    @property
+    def vectorizer(self):
+        """The composite_string vectorizer."""
+        return self.vectorizers.get('composite_string')
+
+    def vocabulary_drift(self):
+        """Returns the share of n-grams transformed since the last full fit that the vocabulary does not know."""
+        return self.oov_terms / self.total_terms if self.total_terms else 0.0
+
+    def row_for(self, movie_id):
+        """Returns the matrix row of a movie, or None if the model does not include it."""
+        return self.row_index.get(movie_id)
+
+    def transform(self, documents):
+        """Returns the matrix rows of documents, each a dict of field name to text."""
+        return sparse.hstack([
+            vectorizer.transform([document.get(field) or '' for document in documents])
+            for field, vectorizer in self.vectorizers.items()
+        ], format='csr', dtype=np.float32)
+
+    def column_weights(self, weights=None):
+        """Returns each matrix column's field weight, for `weights` or the configured field weights."""
+        weights = weights or field_weights()
+        return np.concatenate([
+            np.full(len(vectorizer), weights.get(field, 0), dtype=self.matrix.dtype)
+            for field, vectorizer in self.vectorizers.items()
+        ])
+
+    def weighted(self, rows, weights=None):
+        """Scales query rows by their columns' field weights."""
+        return (rows @ sparse.diags(self.column_weights(weights))).tocsr()
+
+
+def movie_document(movie):
+    """Returns the texts of a movie's similarity fields."""
+    return {field: getattr(movie, field) for field in FIELDS}
+
+def build_row_index(movie_ids):
+    """Maps each movie_id to its matrix row."""
+    return dict(zip(movie_ids.tolist(), range(len(movie_ids))))
+
+
+def fit_model():
+    """Fits a TF-IDF model per field over every movie, or returns None if there are no movies."""
+    rows = list(Movie.objects.order_by('movie_id').values_list('movie_id', *FIELDS))
+    if not rows:
+        return None
+    movie_ids = np.asarray([row[0] for row in rows], dtype=np.int64) # ordered by movie_id, which fixes each movie's matrix row
+    vectorizers = {}
+    matrices = []
+    for position, (field, options) in enumerate(FIELDS.items(), start=1):
+        vectorizer = TfidfVectorizer(
+            **options, dtype=np.float32, min_df=settings.SIMILARITY_MIN_DF, max_features=settings.SIMILARITY_MAX_FEATURES or None
+        )
+        try:
+            matrix = vectorizer.fit_transform(row[position] or '' for row in rows)
+        except ValueError: # no movie has any text in this field yet, or none left after pruning, so it has no columns
+            continue
+        vectorizers[field], matrix = compact_vectorizer(field, vectorizer, matrix)
+        matrices.append(matrix)
+    matrix = sparse.hstack(matrices, format='csr', dtype=np.float32) if matrices else sparse.csr_matrix((len(rows), 0), dtype=np.float32)
+    return TfidfModel(vectorizers, matrix, movie_ids)
+
+def save_model(model):
+    """Writes a model to a new version directory, publishes it and returns the version."""
+    version = model_store.new_version()
+    path = model_store.create_version_dir(MODEL_NAME, version)
+    if model.fit_version is None:
+        model.fit_version = version
+    for field, vectorizer in model.vectorizers.items():
+        np.save(os.path.join(path, f'terms_{field}.npy'), vectorizer.terms)
+        np.save(os.path.join(path, f'idf_{field}.npy'), vectorizer.idf)
+    np.save(os.path.join(path, 'movie_ids.npy'), model.movie_ids)
+    # the raw CSR arrays, which every worker memory maps (see load_model); both index arrays share a dtype so scipy never copies them
+    matrix = model.matrix.tocsr().astype(np.float32)
+    index_dtype = np.int32 if max(matrix.nnz, matrix.shape[1]) < np.iinfo(np.int32).max else np.int64
+    np.save(os.path.join(path, 'data.npy'), matrix.data)
+    np.save(os.path.join(path, 'indices.npy'), matrix.indices.astype(index_dtype))
+    np.save(os.path.join(path, 'indptr.npy'), matrix.indptr.astype(index_dtype))
+    if model.neighbour_ids is not None:
+        np.save(os.path.join(path, 'neighbour_ids.npy'), model.neighbour_ids)
+        np.save(os.path.join(path, 'neighbour_scores.npy'), model.neighbour_scores)
+    with open(os.path.join(path, 'meta.json'), 'w') as meta_file:
+        json.dump({
+            'version': version,
+            'format': MODEL_FORMAT,
+            'fit_version': model.fit_version,
+            'fields': list(FIELDS),
+            'ngram_range': NGRAM_RANGE,
+            'shape': list(matrix.shape),
+            'oov_terms': model.oov_terms,
+            'total_terms': model.total_terms,
+            'neighbour_weights': model.neighbour_weights,
+            'min_df': {field: vectorizer.min_df for field, vectorizer in model.vectorizers.items()},
+        }, meta_file)
+    model_store.publish(MODEL_NAME, version)
+    model.version = version
+    return version
+
+def load_model(version):
+    """Reads a stored model version back into memory, or returns None if it was stored in another layout.
+
+    Never refits: this runs in web workers, which would all fit the catalogue at once on the request path.
+    """
+    path = model_store.version_dir(MODEL_NAME, version)
+    with open(os.path.join(path, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
+    if meta.get('format') != MODEL_FORMAT or meta.get('fields') != list(FIELDS):
+        logger.error("TF-IDF model version %s was stored in an older layout - run `manage.py build_tfidf` to replace it", version)
+        return None
+
+    # memory mapped read only, so every worker shares one copy in the page cache
+    def load(name):
+        return np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+
+    vectorizers = {
+        field: FieldVectorizer(field, load(f'terms_{field}'), load(f'idf_{field}'), meta.get('min_df', {}).get(field, 1))
+        for field in FIELDS if os.path.exists(os.path.join(path, f'terms_{field}.npy'))
+    }
+    matrix = sparse.csr_matrix((load('data'), load('indices'), load('indptr')), shape=tuple(meta['shape']), copy=False)
+    movie_ids = np.load(os.path.join(path, 'movie_ids.npy'))
+    model = TfidfModel(vectorizers, matrix, movie_ids, version, meta.get('oov_terms', 0), meta.get('total_terms', 0),
+                       fit_version=meta.get('fit_version', version), neighbour_weights=meta.get('neighbour_weights'))
+    if os.path.exists(os.path.join(path, 'neighbour_ids.npy')):
+        # a lookup only pages in the rows it reads
+        model.neighbour_ids = load('neighbour_ids')
+        model.neighbour_scores = load('neighbour_scores')
+    return model
+
+def update_model(movie_ids):
+    """Transforms the given movies against the published vocabulary and replaces or appends their rows.
+
+    `movie_ids` may be any iterable, it is read and fetched UPDATE_CHUNK_SIZE movies at a time.
+    Falls back to a full refit when nothing is published yet, or when the vocabulary drift
+    accumulated since the last full fit passes settings.SIMILARITY_REFIT_DRIFT.
+    Returns the newly published model.
+    """
+    version = model_store.current_version(MODEL_NAME)
+    model = load_model(version) if version is not None else None
+    if model is None: # nothing published, or only in an older layout
+        return _refit()
+
+    id_chunks, transformed = [], []
+    unknown = {field: (Counter(), Counter()) for field in FIELDS}
+    for chunk in _chunks(movie_ids, UPDATE_CHUNK_SIZE):
+        rows = list(Movie.objects.filter(movie_id__in=chunk).order_by('movie_id').values('movie_id', *FIELDS))
+        if rows:
+            _count_terms(model, rows, unknown)
+            id_chunks.append(np.asarray([row['movie_id'] for row in rows], dtype=np.int64))
+            transformed.append(model.transform(rows))
+    if not id_chunks:
+        return model
+    _add_drift(model, unknown)
+    if model.vocabulary_drift() > settings.SIMILARITY_REFIT_DRIFT:
+        logger.info("TF-IDF vocabulary drift %.2f passed the threshold, refitting", model.vocabulary_drift())
+        return _refit()
+    updated_ids = np.concatenate(id_chunks)
+
+    # Stack the new rows under the old ones, then pick each movie's newest row
+    old_count = model.matrix.shape[0]
+    stacked = sparse.vstack([model.matrix, *transformed]).tocsr()
+    order = np.arange(old_count)
+    appended = {} # a movie listed twice keeps its last row
+    for index, movie_id in enumerate(updated_ids.tolist()):
+        row = model.row_for(movie_id)
+        if row is None:
+            appended[movie_id] = index
+        else:
+            order[row] = old_count + index
+    appended = np.asarray(list(appended.values()), dtype=np.int64)
+    order = np.concatenate([order, old_count + appended])
+
+    model.matrix = stacked[order]
+    model.movie_ids = np.concatenate([model.movie_ids, updated_ids[appended]])
+    model.row_index = build_row_index(model.movie_ids)
+    if model.neighbour_ids is not None:
+        changed_rows = [row for row in range(len(order)) if order[row] >= old_count]
+        update_neighbours(model, changed_rows)
+    save_model(model)
+    ann.update_index(model, updated_ids.tolist())
+    return model
+
+def _chunks(values, size):
+    """Yields lists of up to `size` items from any iterable, without reading it all first."""
+    chunk = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _vectorizer(model, field):
+    # a field that was empty at the last fit has no vocabulary, so all of its terms are out of it
+    return model.vectorizers.get(field) or FieldVectorizer(
+        field, np.empty(0, dtype=bytes), np.empty(0, dtype=np.float32), settings.SIMILARITY_MIN_DF
+    )
+
+def _count_terms(model, rows, unknown):
+    """Adds the rows' terms to the model's total, and tallies the ones missing from its vocabulary in `unknown`.
+
+    `unknown` maps each field to two Counters of unknown terms: their occurrences and the number of movies using them.
+    """
+    for field in FIELDS:
+        vectorizer = _vectorizer(model, field)
+        analyzer = vectorizer.build_analyzer()
+        row_terms = [analyzer(row[field] or '') for row in rows]
+        terms = [term for terms in row_terms for term in terms]
+        model.total_terms += len(terms)
+        known = iter(vectorizer.columns(terms) >= 0)
+        occurrences, document_frequency = unknown[field]
+        for terms in row_terms:
+            missing = [term for term, is_known in zip(terms, known) if not is_known]
+            occurrences.update(missing)
+            document_frequency.update(set(missing))
+
+def _add_drift(model, unknown):
+    """Counts the tallied unknown terms as out of vocabulary, once every row has been read."""
+    for field, (occurrences, document_frequency) in unknown.items():
+        # terms the fit pruned on purpose are not drift, only new terms used by enough of these movies to be kept
+        min_df = _vectorizer(model, field).min_df
+        model.oov_terms += sum(count for term, count in occurrences.items() if document_frequency[term] >= min_df)
+
+def _refit():
+    """Fits and publishes a new model from scratch, with its neighbour table."""
+    model = fit_model()
+    if model is not None:
+        attach_neighbours(model, settings.SIMILARITY_NEIGHBOURS)
+        save_model(model)
+    return model
+
+def attach_neighbours(model, top_k):
+    """Computes the model's neighbour table under the configured field weights, leaving it without one when `top_k` is 0."""
+    if top_k:
+        model.neighbour_weights = field_weights()
+        model.neighbour_ids, model.neighbour_scores = compute_neighbours(
+            model.matrix, model.movie_ids, top_k, column_weights=model.column_weights(model.neighbour_weights)
+        )
+    return model
+
+def compute_neighbours(matrix, movie_ids, top_k, rows=None, column_weights=None):
+    """Returns the movie_ids and scores of each row's top_k most similar movies, best first.
+
+    Scores are cosine similarities, or with `column_weights` the weighted sum of the per-field cosines.
+    Rows are scored against the whole matrix in blocks (see neighbour_block_size),
+    so only one block x N dense slab of scores is held at a time.
+    """
+    rows = np.arange(matrix.shape[0]) if rows is None else np.asarray(rows, dtype=np.int64)
+    top_k = max(min(top_k, matrix.shape[0] - 1), 1)
+    transposed = matrix.T.tocsr()
+    if column_weights is not None:
+        matrix = (matrix @ sparse.diags(column_weights)).tocsr()
+    neighbour_ids = np.empty((len(rows), top_k), dtype=movie_ids.dtype)
+    neighbour_scores = np.empty((len(rows), top_k), dtype=np.float32)
+
+    block_size = neighbour_block_size(matrix.shape[0])
+    for start in range(0, len(rows), block_size):
+        block_rows = rows[start:start + block_size]
+        scores = (matrix[block_rows] @ transposed).toarray() # rows are L2 normalised, so dot products are cosines
+        scores[np.arange(len(block_rows)), block_rows] = -np.inf # a movie is not its own neighbour
+        top = _top_k(scores, top_k)
+        neighbour_ids[start:start + len(block_rows)] = movie_ids[top]
+        neighbour_scores[start:start + len(block_rows)] = np.take_along_axis(scores, top, axis=1)
+    return neighbour_ids, neighbour_scores
+
+def neighbour_block_size(columns):
+    """Returns how many rows to score per block against `columns` movies within settings.SIMILARITY_NEIGHBOUR_MEMORY_MB."""
+    budget = settings.SIMILARITY_NEIGHBOUR_MEMORY_MB * 2 ** 20
+    return int(max(1, min(NEIGHBOUR_BLOCK_SIZE, budget // (max(columns, 1) * SCORE_BYTES))))
+
+def update_neighbours(model, changed_rows):
+    """Recomputes the neighbours of changed rows and merges the changed movies into every other row's list.
+
+    Rows beyond the current neighbour table (appended movies) must be included in `changed_rows`.
+    A row that had a changed movie in its list and now holds a score below its old lowest one may be missing
+    a movie that was just beyond its old list, so it is rescored against the whole matrix like the changed rows.
+    """
+    row_count = model.matrix.shape[0]
+    top_k = model.neighbour_ids.shape[1]
+    changed_rows = np.asarray(sorted(changed_rows), dtype=np.int64)
+    if len(changed_rows) > row_count // 4 or model.neighbour_weights != field_weights():
+        # cheaper to start again than to merge, or the field weights changed since the table was built
+        attach_neighbours(model, top_k)
+        return model
+
+    column_weights = model.column_weights(model.neighbour_weights)
+    weighted = model.weighted(model.matrix, model.neighbour_weights)
+    changed_ids = model.movie_ids[changed_rows]
+    changed_transposed = model.matrix[changed_rows].T.tocsr()
+    unchanged_rows = np.setdiff1d(np.arange(row_count), changed_rows)
+    neighbour_ids = np.empty((row_count, top_k), dtype=model.movie_ids.dtype)
+    neighbour_scores = np.empty((row_count, top_k), dtype=np.float32)
+    rescored = []
+
+    for start in range(0, len(unchanged_rows), NEIGHBOUR_BLOCK_SIZE):
+        block_rows = unchanged_rows[start:start + NEIGHBOUR_BLOCK_SIZE]
+        old_ids = np.asarray(model.neighbour_ids[block_rows])
+        old_scores = np.array(model.neighbour_scores[block_rows])
+        stale = np.isin(old_ids, changed_ids)
+        floor = old_scores.min(axis=1) # no movie left out of the old list scored above this
+        old_scores[stale] = -np.inf # stale, the changed movies are rescored below
+        new_scores = (weighted[block_rows] @ changed_transposed).toarray()
+        candidate_ids = np.hstack([old_ids, np.broadcast_to(changed_ids, new_scores.shape)])
+        candidate_scores = np.hstack([old_scores, new_scores])
+        top = _top_k(candidate_scores, top_k)
+        neighbour_ids[block_rows] = np.take_along_axis(candidate_ids, top, axis=1)
+        neighbour_scores[block_rows] = np.take_along_axis(candidate_scores, top, axis=1)
+        # a list that dropped a changed movie and took in anything scoring below its old floor, or a stale slot,
+        # may be missing a movie that was just beyond it
+        lost = stale.any(axis=1) & (neighbour_scores[block_rows].min(axis=1) < floor)
+        rescored.append(block_rows[lost])
+
+    rescored = np.concatenate([changed_rows, *rescored])
+    neighbour_ids[rescored], neighbour_scores[rescored] = compute_neighbours(
+        model.matrix, model.movie_ids, top_k, rows=rescored, column_weights=column_weights
+    )
+    model.neighbour_ids, model.neighbour_scores = neighbour_ids, neighbour_scores
+    return model
+
+def similar_movie_ids(model, movie, top_n):
+    """Returns the movie_ids of the top_n movies most similar to `movie`, best first."""
+    row = model.row_for(movie.movie_id)
+    weights = field_weights()
+    if (row is not None and model.neighbour_ids is not None and top_n <= model.neighbour_ids.shape[1]
+            and model.neighbour_weights == weights):
+        # one lookup in the precomputed table
+        neighbour_ids = model.neighbour_ids[row, :top_n]
+        return [int(movie_id) for movie_id in neighbour_ids[np.isfinite(model.neighbour_scores[row, :top_n])]]
+
+    if row is not None:
+        query_vec = model.weighted(model.matrix[row], weights)
+    else:
+        query_vec = model.weighted(model.transform([movie_document(movie)]), weights)
+    if settings.SIMILARITY_BACKEND == 'ivf':
+        # only the movies in the closest partitions are scored; None when no usable index is published
+        approximate = ann.similar_movie_ids(model, query_vec, movie.movie_id, top_n)
+        if approximate is not None:
+            return approximate
+
+    # Otherwise every movie is scored against the whole matrix
+    scores = (model.matrix @ query_vec.T).toarray().ravel()
+    if row is not None:
+        scores[row] = -np.inf
+    top_n = min(top_n, len(scores) - (row is not None))
+    if top_n <= 0:
+        return []
+    top = _top_k(scores[np.newaxis, :], top_n)[0]
+    return [int(movie_id) for movie_id in model.movie_ids[top]]
+
+def batch_similar_movie_ids(model, movies, top_n):
+    """Returns, for each of `movies`, a list of (movie_id, score) for its top_n most similar movies, best first.
+
+    Scores are the weighted sum of the per-field cosine similarities (see TfidfModel).
+    Genres and common words are shared by much of the catalogue, so a query's scores are close to dense:
+    the queries are scored in blocks (see neighbour_block_size) and each block is cut to its top_n before
+    the next is scored, so only one block x N slab of scores is held at a time.
+    Movies with no terms in common are never returned.
+    """
+    if not movies or top_n <= 0:
+        return [[] for _ in movies]
+    rows = [model.row_for(movie.movie_id) for movie in movies]
+    missing = [index for index, row in enumerate(rows) if row is None]
+    queries = model.matrix[[row if row is not None else 0 for row in rows]]
+    if missing:
+        # movies added since the model was built are transformed on the fly, then put in their place
+        transformed = model.transform([movie_document(movies[index]) for index in missing])
+        order = np.arange(len(movies))
+        order[missing] = len(movies) + np.arange(len(missing))
+        queries = sparse.vstack([queries, transformed]).tocsr()[order]
+    queries = model.weighted(queries)
+    transposed = model.matrix.T.tocsr()
+    top_n = min(top_n, model.matrix.shape[0])
+
+    results = []
+    block_size = neighbour_block_size(model.matrix.shape[0])
+    for start in range(0, len(movies), block_size):
+        scores = (queries[start:start + block_size] @ transposed).toarray()
+        for offset, row in enumerate(rows[start:start + block_size]):
+            if row is not None:
+                scores[offset, row] = 0 # a movie is not its own neighbour
+        top = _top_k(scores, top_n)
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        for columns, values in zip(top, top_scores):
+            similar = values > 0
+            results.append(list(zip(model.movie_ids[columns[similar]].tolist(), values[similar].tolist())))
+    return results
+
+def _top_k(scores, k):
+    """Returns the column indices of each row's k highest scores, highest first, without a full sort."""
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1)
+
+
+def _fit_missing_model():
+    logger.warning("No published TF-IDF model, fitting one now - run `manage.py build_tfidf` to avoid this")
+    return _refit()
+
+# The model loaded by this worker process
+published_model = model_store.PublishedModel(MODEL_NAME, load_model, fallback=_fit_missing_model)
+
+def get_model():
+    """Returns this process's TF-IDF model, loading or reloading it when a new version is published."""
+    return published_model.get()
+
+def reset():
+    """Forgets the model loaded by this process so the next get_model call reloads it."""
+    published_model.reset()
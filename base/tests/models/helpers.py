@@ -0,0 +1,13 @@
+import tempfile
+from django.test import override_settings
+
+class TempModelDirMixin:
+    """Publishes models into a throwaway RECOMMENDER_MODEL_DIR for each test."""
+
+    def setUp(self):
+        super().setUp()
+        self.model_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.model_dir.cleanup)
+        settings_override = override_settings(RECOMMENDER_MODEL_DIR=self.model_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
@@ -0,0 +1,69 @@
+import numpy as np
+from django.test import TestCase, override_settings
+from base.models import Movie
+from base import ann, similarity
+from base.tests.models.helpers import TempModelDirMixin
+
+@override_settings(SIMILARITY_NEIGHBOURS=0)
+class TestAnnIndex(TempModelDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        similarity.reset()
+        ann.published_index.reset()
+
+        rng = np.random.default_rng(0)
+        topics = [[f'topic{topic}word{word}' for word in range(20)] for topic in range(8)]
+        for movie_id in range(200):
+            words = rng.choice(topics[movie_id % 8], size=6, replace=False)
+            Movie.objects.create(movie_id=movie_id, title=f'Movie {movie_id}', cleaned_title=f'Movie {movie_id}', composite_string=' '.join(words))
+        self.model = similarity.fit_model()
+        similarity.save_model(self.model)
+
+    def tearDown(self):
+        similarity.reset()
+        ann.published_index.reset()
+
+    def test_partitions_cover_every_movie(self):
+        index = ann.build_index(self.model, components=16, lists=8)
+        self.assertEqual(index.offsets[-1], 200)
+        self.assertEqual(sorted(index.movie_ids.tolist()), list(range(200)))
+
+    def test_falls_back_to_exact_without_a_matching_index(self):
+        query = self.model.matrix[0]
+        self.assertIsNone(ann.similar_movie_ids(self.model, query, 0, 5))
+        index = ann.build_index(self.model, components=16, lists=8)
+        index.model_version = 'an older update'  # misses the movies written since
+        ann.save_index(index)
+        self.assertIsNone(ann.similar_movie_ids(self.model, query, 0, 5))
+
+    def test_incremental_updates_extend_the_index(self):
+        ann.save_index(ann.build_index(self.model, components=16, lists=8))
+        words = ' '.join(f'topic3word{word}' for word in range(6))
+        Movie.objects.create(movie_id=200, title='Movie 200', cleaned_title='Movie 200', composite_string=words)
+        Movie.objects.filter(movie_id=3).update(composite_string=words)
+        with override_settings(SIMILARITY_REFIT_DRIFT=1.0):
+            model = similarity.update_model([3, 200])
+
+        index = ann.load_index(ann.model_store.current_version(ann.MODEL_NAME))
+        self.assertEqual(index.model_version, model.version)
+        self.assertEqual(sorted(index.movie_ids.tolist()), list(range(201)))
+        movie = Movie.objects.get(pk=200)
+        with override_settings(SIMILARITY_BACKEND='exact'):
+            exact = similarity.similar_movie_ids(model, movie, 10)
+        with override_settings(SIMILARITY_BACKEND='ivf', ANN_NPROBE=8, ANN_CANDIDATES=20):
+            approximate = similarity.similar_movie_ids(model, movie, 10)
+        self.assertEqual(exact[0], 3)  # the rewritten movie is found by its new vector
+        self.assertEqual(approximate, exact)
+
+    def test_approximate_results_match_exact_when_probing_every_partition(self):
+        ann.save_index(ann.build_index(self.model, components=16, lists=8))
+        movie = Movie.objects.get(pk=3)
+        with override_settings(SIMILARITY_BACKEND='exact'):
+            exact = similarity.similar_movie_ids(self.model, movie, 10)
+        with override_settings(SIMILARITY_BACKEND='ivf', ANN_NPROBE=8, ANN_CANDIDATES=20):
+            approximate = similarity.similar_movie_ids(self.model, movie, 10)
+        self.assertEqual(approximate, exact)
+
+        with override_settings(SIMILARITY_BACKEND='ivf', ANN_NPROBE=1):
+            probed = similarity.similar_movie_ids(self.model, movie, 10)
+        self.assertGreaterEqual(len(set(probed) & set(exact)), 5)  # same topic, so mostly in the closest partition
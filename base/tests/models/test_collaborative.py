@@ -0,0 +1,70 @@
+from unittest.mock import patch
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from base.models import Movie, Rating, Review
+from base import collaborative
+from base.utils import rerank_recommendations, review_polarities
+from base.tests.models.helpers import TempModelDirMixin
+
+class TestCollaborativeFiltering(TempModelDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        collaborative.rating_matrix.reset()
+        self.target = User.objects.create_user('target')
+        self.alike = User.objects.create_user('alike')
+        self.opposite = User.objects.create_user('opposite')
+        self.movies = [Movie.objects.create(movie_id=i, title=f'Movie {i}', cleaned_title=f'Movie {i}') for i in range(1, 6)]
+
+        for user, ratings in (
+            (self.target, {1: 5, 2: 1}),
+            (self.alike, {1: 5, 2: 1, 3: 5, 4: 1}),
+            (self.opposite, {1: 1, 2: 5, 3: 1, 4: 5, 5: 3}),
+        ):
+            for movie_id, rating in ratings.items():
+                Rating.objects.create(user=user, movie_id=movie_id, rating=rating)
+
+    def tearDown(self):
+        collaborative.rating_matrix.reset()
+
+    def test_user_similarities_use_co_rated_movies(self):
+        ratings = collaborative.load_rating_matrix()
+        similarities = collaborative.user_similarities(ratings, ratings.user_index[self.target.id])
+
+        self.assertAlmostEqual(similarities[ratings.user_index[self.target.id]], 0)
+        self.assertAlmostEqual(similarities[ratings.user_index[self.alike.id]], 1.0)
+        self.assertAlmostEqual(similarities[ratings.user_index[self.opposite.id]], 10 / 26)
+
+    def test_predict_ratings_weights_reviews(self):
+        ratings = collaborative.load_rating_matrix()
+        similarities = collaborative.user_similarities(ratings, ratings.user_index[self.target.id])
+        predictions = collaborative.predict_ratings(ratings, similarities, [3, 5, 99], {(self.opposite.id, 5): -0.5})
+
+        opposite = 10 / 26
+        self.assertAlmostEqual(predictions[3], (5 * 2 + opposite * 1 * 2) / (2 * (1 + opposite)))
+        self.assertAlmostEqual(predictions[5], opposite * 3 * 1.5 / (2 * opposite))
+        self.assertEqual(predictions[99], 0)
+
+    def test_rating_matrix_is_kept_until_ratings_change(self):
+        ratings = collaborative.get_rating_matrix()
+        with self.assertNumQueries(0):
+            self.assertIs(collaborative.get_rating_matrix(), ratings)
+        with self.captureOnCommitCallbacks(execute=True):
+            Rating.objects.create(user=self.target, movie=self.movies[2], rating=4)
+        with self.assertNumQueries(0):
+            self.assertIs(collaborative.get_rating_matrix(), ratings)  # not reloaded per rating
+        with override_settings(RATING_MATRIX_REFRESH_INTERVAL=0):
+            self.assertEqual(collaborative.get_rating_matrix().matrix.nnz, ratings.matrix.nnz + 1)
+
+    def test_rerank_recommendations(self):
+        Review.objects.create(user=self.alike, movie_id=4, title='Great', review='A wonderful, brilliant film.')
+        reranked = rerank_recommendations([self.movies[3], self.movies[4], self.movies[2]], self.target)
+        self.assertEqual([movie.movie_id for movie in reranked], [3, 5, 4])
+
+    def test_review_polarities_are_queried_in_chunks(self):
+        for user in (self.alike, self.opposite):
+            Review.objects.create(user=user, movie_id=3, title='Review', review='A wonderful, brilliant film.')
+        user_ids = [self.alike.id, self.opposite.id]
+        with patch('base.utils.REVIEW_QUERY_CHUNK_SIZE', 1), self.assertNumQueries(2):
+            polarities = review_polarities(user_ids, [3])
+        self.assertEqual(set(polarities), {(self.alike.id, 3), (self.opposite.id, 3)})
+
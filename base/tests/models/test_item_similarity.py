@@ -0,0 +1,59 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from base.models import Movie, Rating
+from base import item_similarity, similarity, recommendation_cache
+from base.views import get_recommendations
+from base.tests.models.helpers import TempModelDirMixin
+
+class TestItemSimilarity(TempModelDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        item_similarity.published_model.reset()
+        similarity.reset()
+        recommendation_cache.clear()
+
+        for movie_id in range(1, 13):
+            Movie.objects.create(movie_id=movie_id, title=f'Movie {movie_id}', cleaned_title=f'Movie {movie_id}')
+        self.users = [User.objects.create_user(f'user{i}') for i in range(4)]
+        for user, liked in zip(self.users, ([1, 2, 3], [1, 2], [1, 4], [5, 6])):
+            for movie_id in liked:
+                Rating.objects.create(user=user, movie_id=movie_id, rating=5)
+        Rating.objects.create(user=self.users[3], movie_id=1, rating=1)  # not a like
+
+    def tearDown(self):
+        item_similarity.published_model.reset()
+        similarity.reset()
+        recommendation_cache.clear()
+
+    def test_recommend_ranks_co_liked_movies(self):
+        item_similarity.save_model(item_similarity.fit_model(top_k=10))
+        self.assertEqual(item_similarity.recommend([1], 10), [2, 3, 4])
+        self.assertEqual(item_similarity.recommend([1, 2], 10, exclude=[4]), [3])
+        self.assertEqual(item_similarity.recommend([12], 10), [])
+
+    def test_top_k_prunes_each_row(self):
+        model = item_similarity.fit_model(top_k=1)
+        self.assertTrue(all(count <= 1 for count in model.matrix.getnnz(axis=1)))
+
+    def test_get_recommendations_ranks_then_fills(self):
+        item_similarity.save_model(item_similarity.fit_model(top_k=10))
+        user = User.objects.create_user('new')
+        Rating.objects.create(user=user, movie_id=2, rating=4)
+
+        recommended = [movie.movie_id for movie in get_recommendations(user)]
+        self.assertEqual(recommended[:2], [1, 3])
+        self.assertEqual(len(set(recommended)), 10)
+        self.assertNotIn(2, recommended)
+
+    def test_get_recommendations_uses_content_until_the_model_is_built(self):
+        Movie.objects.filter(movie_id=2).update(composite_string='alien ripley weaver')
+        Movie.objects.filter(movie_id=9).update(composite_string='aliens ripley weaver cameron')
+        similarity.save_model(similarity.fit_model())
+        user = User.objects.create_user('new')
+        Rating.objects.create(user=user, movie_id=2, rating=5)
+
+        recommended = [movie.movie_id for movie in get_recommendations(user)]
+        self.assertEqual(recommended[0], 9)
+        self.assertEqual(len(set(recommended)), 10)
+        self.assertNotIn(2, recommended)
+
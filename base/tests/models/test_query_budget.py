@@ -0,0 +1,57 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.urls import reverse
+from base.models import Movie, Rating, Review, Watchlist
+from base import movie_stats
+from base.query_budget import assert_query_budget, count_queries
+
+class TestQueryBudget(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('viewer', password='secret')
+        self.movies = [Movie.objects.create(movie_id=i, title=f'Movie {i}', cleaned_title=f'Movie {i}') for i in range(1, 6)]
+        self.client.force_login(self.user)
+
+    def queries_for(self, url):
+        with count_queries() as counter:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(counter)
+
+    def test_watchlist_queries_do_not_grow_with_its_length(self):
+        Watchlist.objects.create(user=self.user, movie=self.movies[0])
+        one = self.queries_for(reverse('watchlist'))
+        for movie in self.movies[1:]:
+            Watchlist.objects.create(user=self.user, movie=movie)
+        self.assertEqual(self.queries_for(reverse('watchlist')), one)
+
+    def test_movie_details_queries_do_not_grow_with_reviews(self):
+        movie = self.movies[0]
+        movie_stats.record_rating(self.user, movie, 4)
+        url = reverse('movie_details', args=[movie.pk])
+        Review.objects.create(user=self.user, movie=movie, title='Good', review='Good film')
+        one = self.queries_for(url)
+        for number in range(3):
+            reviewer = User.objects.create_user(f'reviewer{number}')
+            Review.objects.create(user=reviewer, movie=movie, title='Fine', review='Fine film')
+        for page in range(1, 5):
+            self.assertEqual(self.queries_for(f'{url}?page={page}'), one)
+        response = self.client.get(url)
+        self.assertEqual(response.context['average_rating'], 4)
+
+    def test_assert_query_budget_reports_the_queries(self):
+        with assert_query_budget(1):
+            Movie.objects.count()
+        with self.assertRaisesMessage(AssertionError, '2 queries run, the budget is 1'):
+            with assert_query_budget(1):
+                Movie.objects.count()
+                Rating.objects.count()
+
+    @override_settings(QUERY_BUDGET=1)
+    def test_middleware_logs_views_over_budget(self):
+        with self.assertLogs('base.query_budget', 'WARNING') as logs:
+            self.client.get(reverse('watchlist'))
+        self.assertIn('watchlist ran', logs.output[0])
+
+    @override_settings(QUERY_BUDGET=50)
+    def test_middleware_is_quiet_within_budget(self):
+        with self.assertNoLogs('base.query_budget', 'WARNING'):
+            self.client.get(reverse('watchlist'))
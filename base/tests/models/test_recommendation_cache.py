@@ -0,0 +1,70 @@
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from base.models import Movie, Rating
+from base import similarity, recommendation_cache
+from base.recommendation_cache import LruCache
+from base.utils import cached_recommendations
+from base.tests.models.helpers import TempModelDirMixin
+
+class TestLruCache(TestCase):
+    def test_local_memory_cache_is_flagged_for_deployment(self):
+        local = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache'}}
+        with override_settings(CACHES=local):
+            self.assertEqual([warning.id for warning in recommendation_cache.check_shared_cache(None)], ['base.W001'])
+        with override_settings(CACHES=shared):
+            self.assertEqual(recommendation_cache.check_shared_cache(None), [])
+
+    def test_evicts_least_recently_used(self):
+        lru = LruCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual((lru.get('a'), lru.get('c')), (1, 3))
+        self.assertEqual(lru.stats(), {'size': 2, 'max_size': 2, 'hits': 3, 'misses': 1, 'hit_rate': 0.75})
+
+    def test_entries_expire(self):
+        lru = LruCache(2, timeout=10)
+        with mock.patch('base.recommendation_cache.time.monotonic', return_value=100):
+            lru.set('a', 1)
+        with mock.patch('base.recommendation_cache.time.monotonic', return_value=111):
+            self.assertIsNone(lru.get('a'))
+
+
+class TestCachedRecommendations(TempModelDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        similarity.reset()
+        recommendation_cache.clear()
+        for movie_id, composite in enumerate(['alien ripley', 'aliens ripley', 'alien 3 ripley', 'heat pacino'], start=1):
+            Movie.objects.create(movie_id=movie_id, title=composite, cleaned_title=composite, composite_string=composite)
+        similarity.save_model(similarity.fit_model())
+        self.user = User.objects.create_user('fan')
+
+    def tearDown(self):
+        similarity.reset()
+        recommendation_cache.clear()
+
+    def test_repeat_searches_are_served_from_cache(self):
+        anonymous = mock.Mock(is_authenticated=False)
+        first = cached_recommendations(1, anonymous, top_n=2)
+        self.assertEqual(set(first), {2, 3})
+        with self.assertNumQueries(0):
+            self.assertEqual(cached_recommendations(1, anonymous, top_n=2), first)
+        self.assertEqual(recommendation_cache.similar_movies.hits, 1)
+
+        cached_recommendations(1, self.user, top_n=2)  # a signed in user reuses the movie's similar movies
+        with self.assertNumQueries(0):
+            self.assertEqual(cached_recommendations(1, self.user, top_n=2), first)
+        self.assertEqual(recommendation_cache.user_recommendations.hits, 1)
+
+    def test_rating_retires_the_users_recommendations(self):
+        cached_recommendations(1, self.user, top_n=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            Rating.objects.create(user=self.user, movie_id=4, rating=5)
+        cached_recommendations(1, self.user, top_n=2)
+        self.assertEqual(recommendation_cache.user_recommendations.hits, 0)
+        self.assertEqual(recommendation_cache.user_recommendations.misses, 2)
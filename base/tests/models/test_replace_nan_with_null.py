@@ -0,0 +1,35 @@
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase
+from base.models import Movie
+from base.management.commands.replace_nan_with_null import field_rules
+
+class TestReplaceNanWithNull(TestCase):
+    def setUp(self):
+        Movie.objects.create(movie_id=1, title='Alien', cleaned_title='Alien', overview='nan', tagline='NaN', homepage='', runtime=117)
+        Movie.objects.create(movie_id=2, title='Heat', cleaned_title='Heat', overview='A heist', homepage='http://heat.example', characters='Nan')
+
+    def test_rules_cover_nullable_text_columns(self):
+        names = [name for name, _ in field_rules()]
+        self.assertIn('overview', names)
+        self.assertNotIn('source_hash', names)  # computed, never copied from a CSV cell
+        self.assertNotIn('characters', names)
+        self.assertNotIn('title', names)  # not nullable
+        self.assertNotIn('runtime', names)  # cannot hold NaN
+
+    def test_dry_run_only_counts(self):
+        output = StringIO()
+        call_command('replace_nan_with_null', dry_run=True, stdout=output)
+        self.assertIn('Found 3', output.getvalue())
+        self.assertEqual(Movie.objects.get(movie_id=1).overview, 'nan')
+
+    def test_replaces_nan_values(self):
+        call_command('replace_nan_with_null', stdout=StringIO())
+        alien = Movie.objects.get(movie_id=1)
+        self.assertIsNone(alien.overview)
+        self.assertIsNone(alien.tagline)
+        self.assertIsNone(alien.homepage)
+        self.assertEqual(alien.runtime, 117)
+        heat = Movie.objects.get(movie_id=2)
+        self.assertEqual(heat.overview, 'A heist')
+        self.assertEqual(heat.characters, 'Nan')  # a real character name
@@ -0,0 +1,25 @@
+from io import StringIO
+from django.test import TestCase
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from base.models import Movie, Review
+
+class TestReviewSentiment(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reviewer')
+        self.movie = Movie.objects.create(movie_id=1, title='Movie', cleaned_title='Movie')
+
+    def test_sentiment_is_scored_on_save(self):
+        review = Review.objects.create(user=self.user, movie=self.movie, title='Loved it', review='A wonderful, brilliant film.')
+        self.assertGreater(review.sentiment, 0)
+
+        review.review = 'A terrible, awful film.'
+        review.save()
+        self.assertLess(Review.objects.get(pk=review.pk).sentiment, 0)
+
+    def test_backfill_scores_unscored_reviews(self):
+        review = Review.objects.create(user=self.user, movie=self.movie, title='Hated it', review='A terrible, awful film.')
+        Review.objects.filter(pk=review.pk).update(sentiment=None)
+
+        call_command('backfill_review_sentiment', batch_size=1, stdout=StringIO())
+        self.assertLess(Review.objects.get(pk=review.pk).sentiment, 0)
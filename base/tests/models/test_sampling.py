@@ -0,0 +1,26 @@
+from django.test import TestCase
+from base.models import Movie
+from base import sampling
+
+class TestRandomSampling(TestCase):
+    def setUp(self):
+        sampling.movie_ids.reset()
+        for movie_id in range(1, 21):
+            Movie.objects.create(movie_id=movie_id, title=f'Movie {movie_id}', cleaned_title=f'Movie {movie_id}')
+
+    def test_samples_are_distinct_and_skip_excluded_movies(self):
+        sampled = sampling.sample_movie_ids(10, exclude=[1, 2, 3])
+        self.assertEqual(len(sampled), 10)
+        self.assertEqual(len(set(sampled)), 10)
+        self.assertFalse({1, 2, 3} & set(sampled))
+
+        self.assertEqual(sorted(sampling.sample_movie_ids(50, exclude=[1])), list(range(2, 21)))
+        self.assertEqual(sampling.sample_movie_ids(0), [])
+
+    def test_random_movies_fetch_in_one_query_and_follow_catalogue_changes(self):
+        sampling.movie_ids.get()
+        with self.assertNumQueries(1):
+            self.assertEqual(len(sampling.random_movies(5)), 5)
+
+        Movie.objects.create(movie_id=21, title='Movie 21', cleaned_title='Movie 21')
+        self.assertIn(21, sampling.sample_movie_ids(21))
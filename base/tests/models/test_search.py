@@ -0,0 +1,96 @@
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from base.models import Movie
+from base import search
+
+class TestSearch(TestCase):
+    def setUp(self):
+        search.title_index.reset()
+        titles = ['Alien', 'Aliens', 'Alien Resurrection', 'The Alien Within', 'Sealien', 'Heat', 'Up']
+        for movie_id, title in enumerate(titles, start=1):
+            Movie.objects.create(movie_id=movie_id, title=title, cleaned_title=title)
+
+    def tearDown(self):
+        search.title_index.reset()
+
+    def test_ranks_exact_then_prefix_then_word_then_substring(self):
+        self.assertEqual(search.search_movie_ids('alien'), [1, 2, 3, 4, 5])
+
+    def test_matches_like_icontains(self):
+        for query in ['ALIEN', 'lien', 'ien res', 'h', 'up', 'zzz', 'alien  resurrection']:
+            expected = set(Movie.objects.filter(title__icontains=' '.join(query.split())).values_list('movie_id', flat=True))
+            if len(query.strip()) < 3:  # too short for a trigram, matched as a word prefix
+                expected = {movie_id for movie_id in expected if any(word.lower().startswith(query) for word in Movie.objects.get(pk=movie_id).title.split())}
+            self.assertEqual(set(search.search_movie_ids(query)), expected, query)
+
+    def test_short_queries_match_word_prefixes(self):
+        self.assertEqual(search.search_movie_ids('he'), [6])
+
+    def test_candidates_are_capped_before_ranking(self):
+        index = search.title_index.get()
+        self.assertEqual(index.search('alien', 2, max_candidates=2), [1, 2])  # word prefixes are kept first
+        self.assertEqual(index.search('alien', 10, max_candidates=4), [1, 2, 3, 4])
+        self.assertEqual(index.search('lien', 10, max_candidates=1), [1])
+
+    def test_index_follows_catalogue_changes(self):
+        self.assertEqual(search.search_movie_ids('heist'), [])
+        Movie.objects.create(movie_id=8, title='Heist', cleaned_title='Heist')
+        self.assertEqual(search.search_movie_ids('heist'), [8])
+
+    @override_settings(SEARCH_PAGE_SIZE=2)
+    def test_general_search_is_paginated(self):
+        response = self.client.get(reverse('general_search'), {'title': 'alien', 'page': 2})
+        page = response.context['search_results']
+        self.assertEqual([movie.movie_id for movie in page], [3, 4])
+        self.assertEqual(page.paginator.num_pages, 3)
+        self.assertContains(response, 'page=3')
+
+
+class TestAutocomplete(TestCase):
+    def setUp(self):
+        search.completion_index.reset()
+        for movie_id, title in enumerate(['Alien', 'Aliens', 'Alien³', 'Heat', 'Star Wars: A New Hope'], start=1):
+            Movie.objects.create(movie_id=movie_id, title=title, cleaned_title=title)
+
+    def tearDown(self):
+        search.completion_index.reset()
+
+    def test_completes_prefixes_in_title_order(self):
+        self.assertEqual([match['movie_id'] for match in search.complete_titles('ALI')], [1, 3, 2])
+        self.assertEqual(search.complete_titles('star wars a'), [{'movie_id': 5, 'title': 'Star Wars: A New Hope'}])
+        self.assertEqual(search.complete_titles('x'), [])
+        self.assertEqual(search.complete_titles('  '), [])
+
+    @override_settings(AUTOCOMPLETE_LIMIT=2)
+    def test_endpoint_is_limited_and_served_from_memory(self):
+        search.complete_titles('a')  # build the index
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('autocomplete'), {'q': 'al', 'limit': 50})
+        self.assertEqual(response.json(), {'results': [{'movie_id': 1, 'title': 'Alien'}, {'movie_id': 3, 'title': 'Alien³'}]})
+
+
+class TestTitleResolver(TestCase):
+    def setUp(self):
+        search.fuzzy_title_index.reset()
+        for movie_id, title in enumerate(['Alien', 'Aliens', 'The Godfather', 'The Godfather: Part II', 'Heat'], start=1):
+            Movie.objects.create(movie_id=movie_id, title=title, cleaned_title=title)
+
+    def tearDown(self):
+        search.fuzzy_title_index.reset()
+
+    def test_edit_distance(self):
+        self.assertEqual(search.edit_distance('kitten', 'sitting'), 3)
+        self.assertEqual(search.edit_distance('', 'heat'), 4)
+        self.assertEqual(search.edit_distance('heat', 'heat'), 0)
+
+    def test_resolves_exact_and_misspelt_titles(self):
+        self.assertEqual(search.resolve_title('alien').movie_id, 1)
+        resolution = search.resolve_title('the godfahter')
+        self.assertEqual((resolution.movie_id, resolution.title), (3, 'The Godfather'))
+        self.assertEqual(resolution.alternatives[0], {'movie_id': 4, 'title': 'The Godfather: Part II'})
+
+    def test_no_match_for_unrelated_titles(self):
+        resolution = search.resolve_title('zzzzzz')
+        self.assertIsNone(resolution.movie_id)
+        self.assertEqual(resolution.alternatives, [])
+        self.assertIsNone(search.resolve_title('').movie_id)
@@ -0,0 +1,60 @@
+from django.test import TestCase
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from base.models import Movie, MovieStats, Rating, Review
+from base import sections, movie_stats
+from base.tests.models.helpers import TempModelDirMixin
+
+class TestHomepageSections(TempModelDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.users = [User.objects.create_user(f'user{i}') for i in range(2)]
+        self.movie = Movie.objects.create(movie_id=1, title='Movie', cleaned_title='Movie')
+        movie_stats.record_rating(self.users[0], self.movie, 5)
+        movie_stats.record_rating(self.users[1], self.movie, 2)
+
+    def test_recently_reviewed_average_is_not_inflated_by_reviews(self):
+        for title in ('One', 'Two'):
+            movie_stats.record_review(Review(user=self.users[0], movie=self.movie, title=title, review='Good'))
+
+        [movie] = sections.recently_reviewed_movies()
+        self.assertAlmostEqual(movie.avg_rating, 3.5)
+        self.assertEqual(movie.latest_review, Review.objects.latest('created_at').created_at)
+
+    def test_sections_are_cached_until_a_rating_is_written(self):
+        self.assertAlmostEqual(sections.top_rated_films()[0].avg_rating, 3.5)
+        with self.assertNumQueries(0):
+            sections.top_rated_films()
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            movie_stats.record_rating(self.users[1], self.movie, 4)
+            self.assertAlmostEqual(sections.top_rated_films()[0].avg_rating, 3.5)  # not invalidated before the commit
+        for callback in callbacks:
+            callback()
+        self.assertAlmostEqual(sections.top_rated_films()[0].avg_rating, 4.5)
+
+class TestMovieStats(TempModelDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.users = [User.objects.create_user(f'user{i}') for i in range(3)]
+        self.movie = Movie.objects.create(movie_id=1, title='Movie', cleaned_title='Movie')
+
+    def test_record_rating_keeps_totals_in_step(self):
+        movie_stats.record_rating(self.users[0], self.movie, 4)
+        movie_stats.record_rating(self.users[1], self.movie, 1)
+        movie_stats.record_rating(self.users[1], self.movie, 3)  # re-rating replaces the old rating
+
+        stats = MovieStats.objects.get(movie=self.movie)
+        self.assertEqual((stats.rating_count, stats.rating_sum, stats.rating_mean), (2, 7, 3.5))
+        self.assertEqual(Rating.objects.count(), 2)
+
+    def test_rebuild_matches_incremental_stats(self):
+        movie_stats.record_rating(self.users[0], self.movie, 4)
+        movie_stats.record_review(Review(user=self.users[0], movie=self.movie, title='Title', review='Text'))
+        Rating.objects.create(user=self.users[2], movie=self.movie, rating=1)  # written behind the stats' back
+
+        movie_stats.rebuild_stats()
+        stats = MovieStats.objects.get(movie=self.movie)
+        self.assertEqual((stats.rating_count, stats.rating_sum, stats.review_count), (2, 5, 1))
+        self.assertAlmostEqual(stats.rating_mean, 2.5)
@@ -0,0 +1,237 @@
+import json
+from unittest import mock
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from base.models import Movie
+from base import similarity, model_store, search, recommendation_cache
+from base.utils import find_similar_movies
+from base.tests.models.helpers import TempModelDirMixin
+
+class TestSimilarityModel(TempModelDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        similarity.reset()
+        recommendation_cache.clear()
+        search.fuzzy_title_index.reset()
+
+        Movie.objects.create(movie_id=3, title='Alien', cleaned_title='Alien', composite_string='alien sigourney weaver ripley ridley scott')
+        Movie.objects.create(movie_id=1, title='Aliens', cleaned_title='Aliens', composite_string='aliens sigourney weaver ripley james cameron')
+        Movie.objects.create(movie_id=2, title='Notting Hill', cleaned_title='Notting Hill', composite_string='notting hill hugh grant julia roberts')
+
+    def tearDown(self):
+        similarity.reset()
+
+    def test_save_and_load_round_trip(self):
+        model = similarity.fit_model()
+        version = similarity.save_model(model)
+
+        self.assertEqual(model_store.current_version(similarity.MODEL_NAME), version)
+        loaded = similarity.load_model(version)
+        self.assertEqual(list(loaded.movie_ids), [1, 2, 3])  # rows are ordered by movie_id
+        self.assertAlmostEqual(abs(loaded.matrix - model.matrix).sum(), 0)
+        query = 'alien ripley'
+        self.assertAlmostEqual(abs(loaded.vectorizer.transform([query]) - model.vectorizer.transform([query])).sum(), 0)
+
+    def test_get_model_fits_once_and_reloads_new_versions(self):
+        with override_settings(RECOMMENDER_MODEL_CHECK_INTERVAL=0):
+            first = similarity.get_model()
+            self.assertIsNotNone(first.version)
+            self.assertIs(similarity.get_model(), first)  # published version unchanged, no reload
+
+            Movie.objects.create(movie_id=4, title='Alien 3', cleaned_title='Alien 3', composite_string='alien 3 ripley')
+            similarity.save_model(similarity.fit_model())
+            second = similarity.get_model()
+            self.assertNotEqual(second.version, first.version)
+            self.assertEqual(second.matrix.shape[0], 4)
+
+    def test_find_similar_movies_uses_published_model(self):
+        similarity.save_model(similarity.fit_model())
+        similar = list(find_similar_movies('alien', top_n=1).values_list('movie_id', flat=True))
+        self.assertEqual(similar, [1])
+
+    def test_update_model_replaces_and_appends_rows(self):
+        similarity.save_model(similarity.fit_model())
+        Movie.objects.filter(movie_id=2).update(composite_string='notting hill hugh grant ripley')
+        Movie.objects.create(movie_id=5, title='Aliens 2', cleaned_title='Aliens 2', composite_string='aliens sigourney weaver ripley')
+
+        # fetched a movie at a time, with a movie listed twice
+        with override_settings(SIMILARITY_REFIT_DRIFT=1.0), mock.patch('base.similarity.UPDATE_CHUNK_SIZE', 1):
+            model = similarity.update_model(iter([5, 2, 5]))
+
+        self.assertEqual(list(model.movie_ids), [1, 2, 3, 5])
+        self.assertEqual(model_store.current_version(similarity.MODEL_NAME), model.version)
+        expected = model.vectorizer.transform(['notting hill hugh grant ripley', 'aliens sigourney weaver ripley'])
+        self.assertAlmostEqual(abs(model.matrix[[1, 3]] - expected).sum(), 0)
+
+    def test_update_model_refits_when_vocabulary_drifts(self):
+        first = similarity.fit_model()
+        similarity.save_model(first)
+        Movie.objects.create(movie_id=6, title='Heat', cleaned_title='Heat', composite_string='heat al pacino robert de niro michael mann')
+
+        with override_settings(SIMILARITY_REFIT_DRIFT=0.2):
+            model = similarity.update_model([6])
+
+        self.assertIn('pacino', model.vectorizer)
+        self.assertEqual(model.vocabulary_drift(), 0.0)
+
+    def test_older_layouts_are_not_refit_on_load(self):
+        model = similarity.fit_model()
+        version = similarity.save_model(model)
+        meta_path = f'{model_store.version_dir(similarity.MODEL_NAME, version)}/meta.json'
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        with open(meta_path, 'w') as meta_file:
+            json.dump({**meta, 'format': similarity.MODEL_FORMAT - 1}, meta_file)
+
+        with self.assertLogs('base.similarity', 'ERROR'):
+            self.assertIsNone(similarity.get_model())
+        self.assertIsNone(similarity.get_model())  # not tried again
+        self.assertEqual(model_store.current_version(similarity.MODEL_NAME), version)  # nothing was refit
+
+        with override_settings(SIMILARITY_REFIT_DRIFT=1.0):
+            refit = similarity.update_model([1])  # the commands still replace it
+        self.assertNotEqual(refit.version, version)
+        self.assertEqual(similarity.get_model().version, refit.version)
+
+    def test_neighbour_table_matches_brute_force(self):
+        model = similarity.attach_neighbours(similarity.fit_model(), 2)
+        scores = (model.matrix @ model.matrix.T).toarray()
+        np.fill_diagonal(scores, -np.inf)
+        expected = model.movie_ids[np.argsort(-scores, axis=1, kind='stable')[:, :2]]
+        np.testing.assert_array_equal(model.neighbour_ids, expected)
+
+        similarity.save_model(model)
+        loaded = similarity.load_model(model.version)
+        self.assertEqual(similarity.similar_movie_ids(loaded, Movie.objects.get(pk=3), 1), [1])
+
+    def test_neighbour_blocks_fit_the_memory_budget(self):
+        with override_settings(SIMILARITY_NEIGHBOUR_MEMORY_MB=256):
+            self.assertEqual(similarity.neighbour_block_size(10 ** 6), 16)
+            self.assertEqual(similarity.neighbour_block_size(3), similarity.NEIGHBOUR_BLOCK_SIZE)
+        model = similarity.fit_model()
+        expected = similarity.compute_neighbours(model.matrix, model.movie_ids, 2)
+        with override_settings(SIMILARITY_NEIGHBOUR_MEMORY_MB=0):  # one row per block
+            self.assertEqual(similarity.neighbour_block_size(3), 1)
+            np.testing.assert_array_equal(similarity.compute_neighbours(model.matrix, model.movie_ids, 2)[0], expected[0])
+
+    def test_update_model_merges_neighbours(self):
+        similarity.save_model(similarity.attach_neighbours(similarity.fit_model(), 2))
+        Movie.objects.create(movie_id=5, title='Aliens 2', cleaned_title='Aliens 2', composite_string='alien sigourney weaver ripley')
+
+        with override_settings(SIMILARITY_REFIT_DRIFT=1.0):
+            model = similarity.update_model([5])
+
+        expected_ids, _ = similarity.compute_neighbours(model.matrix, model.movie_ids, 2)
+        np.testing.assert_array_equal(model.neighbour_ids, expected_ids)
+        self.assertEqual(similarity.similar_movie_ids(model, Movie.objects.get(pk=3), 1), [5])
+
+    def test_update_model_refills_lists_that_lose_a_neighbour(self):
+        Movie.objects.create(movie_id=4, title='Alien 3', cleaned_title='Alien 3', composite_string='alien 3 ripley david fincher')
+        Movie.objects.create(movie_id=5, title='Love Actually', cleaned_title='Love Actually', composite_string='love actually hugh grant emma thompson')
+        similarity.save_model(similarity.attach_neighbours(similarity.fit_model(), 1))
+        self.assertEqual(similarity.similar_movie_ids(similarity.get_model(), Movie.objects.get(pk=3), 1), [1])
+        # Aliens stops resembling Alien, whose next best movie was never in its list
+        Movie.objects.filter(movie_id=1).update(composite_string='notting hill hugh grant')
+
+        with override_settings(SIMILARITY_REFIT_DRIFT=1.0):
+            model = similarity.update_model([1])
+
+        expected_ids, expected_scores = similarity.compute_neighbours(model.matrix, model.movie_ids, 1)
+        np.testing.assert_allclose(model.neighbour_scores, expected_scores, rtol=1e-5)
+        similar = expected_scores > 0  # movies sharing no terms tie at 0, in no particular order
+        np.testing.assert_array_equal(model.neighbour_ids[similar], expected_ids[similar])
+        self.assertEqual(similarity.similar_movie_ids(model, Movie.objects.get(pk=3), 1), [4])
+
+    def test_find_similar_movies_keeps_rank_order(self):
+        Movie.objects.create(movie_id=0, title='Alien Resurrection', cleaned_title='Alien Resurrection', composite_string='alien ripley')
+        model = similarity.fit_model()
+        similarity.save_model(model)
+
+        self.assertEqual(model.row_index, {0: 0, 1: 1, 2: 2, 3: 3})
+        similar = list(find_similar_movies('alien', top_n=3).values_list('movie_id', flat=True))
+        self.assertEqual(similar, [1, 0, 2])  # by similarity, not by movie_id
+
+    def test_batch_matches_single_queries(self):
+        model = similarity.fit_model()
+        similarity.save_model(model)
+        Movie.objects.create(movie_id=4, title='Alien 3', cleaned_title='Alien 3', composite_string='alien 3 ripley')  # not in the model
+        movies = list(Movie.objects.filter(movie_id__in=[3, 4, 1]))
+
+        batch = similarity.batch_similar_movie_ids(model, movies, 2)
+        for movie, ranked in zip(movies, batch):
+            self.assertEqual([movie_id for movie_id, _ in ranked], similarity.similar_movie_ids(model, movie, 2)[:len(ranked)])
+            self.assertTrue(all(score > 0 for _, score in ranked))
+        with override_settings(SIMILARITY_NEIGHBOUR_MEMORY_MB=0):  # one query per block
+            self.assertEqual(similarity.batch_similar_movie_ids(model, movies, 2), batch)
+
+    def test_recommendations_api_rejects_non_list_ids(self):
+        for payload in ({'movie_ids': '12'}, {'titles': 'Alien'}):
+            response = self.client.post(reverse('recommendations_api'), json.dumps(payload), content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_recommendations_api(self):
+        similarity.save_model(similarity.fit_model())
+        payload = {'movie_ids': [3, 99], 'titles': ['Alienns'], 'top_n': 1}
+        response = self.client.post(reverse('recommendations_api'), json.dumps(payload), content_type='application/json')
+
+        results = response.json()['results']
+        self.assertEqual([result['movie_id'] for result in results], [3, 99, 1])
+        self.assertEqual([recommendation['movie_id'] for recommendation in results[0]['recommendations']], [1])
+        self.assertEqual(results[1]['recommendations'], [])
+        self.assertEqual([recommendation['movie_id'] for recommendation in results[2]['recommendations']], [3])
+
+        response = self.client.post(reverse('recommendations_api'), 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_field_weights_apply_without_refitting(self):
+        Movie.objects.filter(movie_id__in=[2, 3]).update(genres='Science Fiction|Horror')
+        Movie.objects.filter(movie_id=1).update(genres='Action')
+        weights = {'composite_string': 1.0, 'genres': 0.0}
+        with override_settings(SIMILARITY_FIELD_WEIGHTS=weights):
+            model = similarity.attach_neighbours(similarity.fit_model(), 1)
+            similarity.save_model(model)
+            self.assertEqual(similarity.similar_movie_ids(model, Movie.objects.get(pk=3), 1), [1])  # shared cast and crew
+
+        with override_settings(SIMILARITY_FIELD_WEIGHTS={**weights, 'genres': 5.0}):
+            self.assertEqual(similarity.similar_movie_ids(model, Movie.objects.get(pk=3), 1), [2])  # shared genres
+            genre_columns = model.matrix[:, -len(model.vectorizers['genres']):]
+            expected = 1.0 * (model.matrix[2] @ model.matrix[0].T).toarray()[0, 0] + 4.0 * (genre_columns[2] @ genre_columns[0].T).toarray()[0, 0]
+            scores = dict(similarity.batch_similar_movie_ids(model, [Movie.objects.get(pk=3)], 2)[0])
+            self.assertAlmostEqual(scores[1], expected)
+
+    def test_stored_compactly_and_memory_mapped(self):
+        model = similarity.fit_model()
+        similarity.save_model(model)
+        loaded = similarity.load_model(model.version)
+
+        self.assertEqual(loaded.matrix.dtype, np.float32)
+        for array in (loaded.matrix.data, loaded.matrix.indices, loaded.matrix.indptr):
+            self.assertFalse(array.flags.owndata or array.flags.writeable)  # read only views of the mapped files
+        self.assertIsInstance(loaded.vectorizer.terms, np.memmap)
+        documents = ['alien ripley', 'sigourney weaver in notting hill', 'nothing known']
+        expected = TfidfVectorizer(ngram_range=similarity.NGRAM_RANGE).fit(Movie.objects.order_by('movie_id').values_list('composite_string', flat=True))
+        expected_rows = expected.transform(documents)[:, np.argsort(expected.get_feature_names_out())]
+        self.assertAlmostEqual(abs(loaded.vectorizer.transform(documents) - expected_rows).sum(), 0, places=5)
+
+    def test_min_df_prunes_the_vocabulary(self):
+        with override_settings(SIMILARITY_MIN_DF=2):
+            model = similarity.fit_model()
+        self.assertIn('sigourney weaver', model.vectorizer)
+        self.assertNotIn('notting', model.vectorizer)  # only in one movie
+        self.assertEqual(model.matrix.shape[1], len(model.vectorizer))
+
+    def test_pruned_terms_are_not_vocabulary_drift(self):
+        with override_settings(SIMILARITY_MIN_DF=2):
+            first = similarity.fit_model()
+            similarity.save_model(first)
+            with override_settings(SIMILARITY_REFIT_DRIFT=0.2):
+                model = similarity.update_model([1, 2, 3])  # unchanged, but full of terms only one movie uses
+        self.assertEqual(model.fit_version, first.fit_version)
+        self.assertEqual(model.vocabulary_drift(), 0.0)
+
+        with override_settings(SIMILARITY_MAX_FEATURES=3):
+            model = similarity.fit_model()
+        self.assertEqual(len(model.vectorizer), 3)
+        self.assertEqual(model.vectorizer.min_df, 2)  # the rarest kept term is in two movies
@@ -0,0 +1,43 @@
+from django.test import TestCase
+from django.urls import reverse
+from base.models import Movie
+from base import similarity, search, sampling, utils, warmup
+from base.tests.models.helpers import TempModelDirMixin
+
+class TestWarmup(TempModelDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.reset()
+        Movie.objects.create(movie_id=1, title='Alien', cleaned_title='Alien', composite_string='alien ripley')
+        Movie.objects.create(movie_id=2, title='Heat', cleaned_title='Heat', composite_string='heat pacino de niro')
+        similarity.save_model(similarity.fit_model())
+
+    def tearDown(self):
+        self.reset()
+
+    def reset(self):
+        for _, artefact, _ in warmup.artefacts():
+            artefact.reset()
+        utils.vectorizer = utils.tfidf = None
+
+    def test_not_ready_until_preloaded(self):
+        response = self.client.get(reverse('readiness'))
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(response.json()['models']['tfidf']['loaded'])
+        self.assertFalse(similarity.published_model.loaded)  # checking readiness does not load anything
+
+    def test_preload_loads_everything(self):
+        with self.assertNumQueries(0):
+            self.client.get(reverse('readiness'))
+        warmup.preload()
+
+        self.assertIsNotNone(utils.tfidf)
+        self.assertTrue(search.completion_index.loaded and sampling.movie_ids.loaded)
+        response = self.client.get(reverse('readiness'))
+        self.assertEqual(response.status_code, 200)
+        models = response.json()['models']
+        self.assertEqual(models['tfidf']['version'], similarity.get_model().version)
+        # nothing published for item similarity yet, which does not stop the worker serving
+        self.assertEqual(models['item_similarity'], {'loaded': False, 'version': None})
+        with self.assertNumQueries(0):
+            search.complete_titles('ali')
@@ -1,8 +1,14 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from multiprocessing import Pool
+from io import StringIO
+from django.test import TestCase, override_settings
 from django.core.management import call_command
 from django.core.management.base import BaseCommand
 from unittest.mock import patch
 from base.models import Movie
+from base import movie_rows, similarity
 import pandas as pd
 from base.management.commands.write_movies import Command
 
@@ -27,41 +33,35 @@ class TestWriteMovies(TestCase):
         # Create an existing movie in the database
         Movie.objects.create(movie_id=101, title='Existing Movie')
 
-    @patch('pandas.read_csv')
-    def test_write_movies_success(self, mock_read_csv):
-        mock_read_csv.return_value = self.test_data
-        call_command('write_movies', csv_file='test.csv')
+    def test_write_movies_success(self):
+        self.addCleanup(similarity.reset)
+        with tempfile.TemporaryDirectory() as directory, override_settings(RECOMMENDER_MODEL_DIR=directory):
+            credits_path, movies_path = self.write_csv_files(directory)
+            call_command('write_movies', credits_csv=credits_path, movies_csv=movies_path, stdout=StringIO())
 
-        self.assertEqual(Movie.objects.count(), 3)
-
-        # Test Movie 1 (new movie)
-        new_movie = Movie.objects.get(movie_id=100)
-        self.assertEqual(new_movie.title, 'Test Movie 1')
-        self.assertEqual(new_movie.actors, 'Actor A|Actor B')
-        self.assertEqual(new_movie.characters, 'Char A|Char B')
-        self.assertEqual(new_movie.director, 'Director X|Director Z')
-        self.assertEqual(new_movie.writer, 'Writer Y')
+            self.assertEqual(Movie.objects.count(), 3)
 
-        # Test Movie 2 (existing movie, should not be updated)
-        existing_movie = Movie.objects.get(movie_id=101)
-        self.assertEqual(existing_movie.title, 'Existing Movie')
+            # Test Movie 1 (new movie)
+            new_movie = Movie.objects.get(movie_id=100)
+            self.assertEqual(new_movie.title, 'Test Movie 1')
+            self.assertEqual(new_movie.actors, 'Actor A|Actor B')
+            self.assertEqual(new_movie.characters, 'Char A|Char B')
+            self.assertEqual(new_movie.director, 'Director X|Director Z')
+            self.assertEqual(new_movie.writer, 'Writer Y')
+            self.assertEqual(new_movie.runtime, 90)
 
-        # Test composite string generation
-        composite_string = Movie.objects.get(movie_id=100).composite_string
-        expected_components = ['test movie 1', 'actor a', 'actor b', 'char a', 'char b', 'director x', 'director z', 'writer y']
-        for component in expected_components:
-            self.assertIn(component, composite_string)
-        
+            # Test Movie 2 (existing movie, updated from the CSV)
+            existing_movie = Movie.objects.get(movie_id=101)
+            self.assertEqual(existing_movie.title, 'Test Movie 2')
 
-    @patch('pandas.read_csv')
-    def test_invalid_movie_id(self, mock_read_csv):
-        mock_read_csv.return_value = self.test_data
-
-        command = Command() 
-        self.assertTrue(command.invalid_movie_id(100))  # New ID
-        self.assertTrue(command.invalid_movie_id(101))  # Existing ID
-        self.assertFalse(command.invalid_movie_id('invalid'))  # Non-integer ID
+            # Test composite string generation
+            composite_string = Movie.objects.get(movie_id=100).composite_string
+            expected_components = ['test movie 1', 'actor a', 'actor b', 'char a', 'char b', 'director x', 'director z', 'writer y']
+            for component in expected_components:
+                self.assertIn(component, composite_string)
 
+            # the written movies are published to similarity search
+            self.assertEqual(sorted(similarity.get_model().movie_ids.tolist()), [100, 101, 102])
 
     def test_extract_actors(self):  # Test the extract_actors method
         command = Command()
@@ -108,3 +108,90 @@ class TestWriteMovies(TestCase):
         expected_components = ['test movie 1', 'actor a', 'actor b', 'char a', 'char b', 'director x', 'director z', 'writer y']
         for component in expected_components:
             self.assertIn(component, composite_string)
+
+    def test_write_movies_bulk_upsert(self):
+        movies_data = pd.DataFrame({
+            'id': [102, 100, 101],
+            'budget': [1000.0, float('nan'), 5],
+            'overview': ['Third', float('nan'), 'Second'],
+            'genres': ['[{"id": 1, "name": "Drama"}]', '[]', '[{"id": 2, "name": "Comedy"}, {"id": 3, "name": "Horror"}]'],
+            'release_date': ['2001-02-03', '03/02/2001', float('nan')],
+            'runtime': [90.0, float('nan'), 100.0],
+        })
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(RECOMMENDER_MODEL_DIR=directory):
+            credits_path = os.path.join(directory, 'credits.csv')
+            movies_path = os.path.join(directory, 'movies.csv')
+            self.test_data.to_csv(credits_path, index=False)
+            movies_data.to_csv(movies_path, index=False)
+            with patch.object(Command, 'read_movies', autospec=True, side_effect=Command.read_movies) as read_movies:
+                call_command('write_movies', credits_csv=credits_path, movies_csv=movies_path, batch_size=1, chunksize=2,
+                             skip_index_update=True, stdout=StringIO())
+
+        # each credits chunk reads only the movies rows it joins to
+        self.assertEqual([call.args[2] for call in read_movies.call_args_list], [{1, 2}, {0}])
+        self.assertEqual(Movie.objects.count(), 3)
+        first = Movie.objects.get(movie_id=100)
+        self.assertEqual(first.director, 'Director X|Director Z')
+        self.assertIsNone(first.budget)
+        self.assertIsNone(first.overview)
+        self.assertIsNone(first.genres)
+        self.assertEqual(first.release_date.year, 2001)
+
+        existing = Movie.objects.get(movie_id=101)  # rows already in the table are updated in place
+        self.assertEqual(existing.title, 'Test Movie 2')
+        self.assertEqual(existing.genres, 'Comedy|Horror')
+        self.assertEqual(existing.runtime, 100)
+
+        invalid = Movie.objects.get(movie_id=102)
+        self.assertIsNone(invalid.director)
+        self.assertEqual(invalid.composite_string, 'invalid movie actor d actor e char d char e')
+
+    def test_parallel_parsing_matches_serial(self):
+        records = self.test_data.assign(genres='[{"id": 1, "name": "Drama"}]', release_date='2001-02-03').to_dict('records')
+        batches = [records[:2], records[2:]]
+        with Pool(2) as pool:
+            parallel = list(pool.imap(movie_rows.parse_movies, batches))
+        self.assertEqual(parallel, [movie_rows.parse_movies(batch) for batch in batches])
+
+    def write_csv_files(self, directory):
+        credits_path = os.path.join(directory, 'credits.csv')
+        movies_path = os.path.join(directory, 'movies.csv')
+        self.test_data.to_csv(credits_path, index=False)
+        pd.DataFrame({'id': [100, 101, 102], 'runtime': [90, 100, 110]}).to_csv(movies_path, index=False)
+        return credits_path, movies_path
+
+    def test_unchanged_rows_are_not_rewritten(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(RECOMMENDER_MODEL_DIR=directory):
+            credits_path, movies_path = self.write_csv_files(directory)
+            options = {'credits_csv': credits_path, 'movies_csv': movies_path, 'skip_index_update': True, 'stdout': StringIO()}
+            call_command('write_movies', **options)
+            Movie.objects.filter(movie_id=100).update(title='Edited')
+
+            output = StringIO()
+            call_command('write_movies', **{**options, 'stdout': output})
+            self.assertIn('wrote 0 movies, 3 unchanged', output.getvalue())
+            self.assertEqual(Movie.objects.get(movie_id=100).title, 'Edited')
+
+            call_command('write_movies', **{**options, 'force': True})
+            self.assertEqual(Movie.objects.get(movie_id=100).title, 'Test Movie 1')
+
+    def test_resumes_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(RECOMMENDER_MODEL_DIR=directory):
+            credits_path, movies_path = self.write_csv_files(directory)
+            checkpoint_path = os.path.join(directory, 'checkpoint.json')
+            with open(checkpoint_path, 'w') as checkpoint_file:
+                json.dump({'credits_csv': credits_path, 'rows': 2, 'written': 1}, checkpoint_file)
+            with open(f'{checkpoint_path}.ids', 'w') as ids_file:
+                ids_file.write('101\n')  # written before the interruption
+
+            indexed = []
+            with patch('base.similarity.update_model', side_effect=lambda movie_ids: indexed.extend(movie_ids)):
+                call_command('write_movies', credits_csv=credits_path, movies_csv=movies_path, checkpoint=checkpoint_path,
+                             batch_size=1, stdout=StringIO())
+
+            self.assertFalse(Movie.objects.filter(movie_id=100).exists())  # before the checkpoint
+            self.assertEqual(Movie.objects.get(movie_id=101).title, 'Existing Movie')
+            self.assertEqual(Movie.objects.get(movie_id=102).runtime, 110)
+            self.assertEqual(indexed, [101, 102])  # movies from both runs reach the index
+            self.assertFalse(os.path.exists(checkpoint_path) or os.path.exists(f'{checkpoint_path}.ids'))
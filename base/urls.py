@@ -22,6 +22,9 @@ urlpatterns = [
     path('', views.homepage, name='homepage'),
     path('movie_search/', views.movie_search, name='movie_search'),
     path('search/', views.general_search, name='general_search'),
+    path('autocomplete/', views.autocomplete, name='autocomplete'),
+    path('api/recommendations/', views.recommendations_api, name='recommendations_api'),
+    path('health/ready/', views.readiness, name='readiness'),
     path('chatbot/', views.chatbot, name='chatbot'),
     path('admin/', admin.site.urls),
     path('register/', views.register, name='register'),
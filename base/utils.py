@@ -1,51 +1,90 @@
 # helper methods for views.py
 # circumvents issues around dependency injection, circular imports, encapsulation, and order of operations
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from textblob import TextBlob
+from itertools import zip_longest
+from django.db.models import Case, When
 from .models import Movie, Rating, Review
-import numpy as np
+from . import similarity, collaborative, sentiment, search, recommendation_cache
 
 
+REVIEW_QUERY_CHUNK_SIZE = 500 # users per review_polarities query, well under SQLite's limit on bound parameters
+
 # Global variable to store the vectorizer and TF-IDF matrix
 vectorizer = None
 tfidf = None
 
 def initialize_tfidf():
-    """Initializes the TF-IDF vectorizer and matrix."""
+    """Loads this process's published TF-IDF vectorizer and matrix (see similarity.get_model)."""
     global vectorizer, tfidf
-    vectorizer = TfidfVectorizer(ngram_range=(1, 2)) # finds similarities for one and two word groups
-    tfidf = vectorizer.fit_transform(Movie.objects.values_list('composite_string', flat=True))
+    model = similarity.get_model()
+    if model is not None:
+        vectorizer, tfidf = model.vectorizer, model.matrix
 
 def analyze_sentiment(review_text):
     """Analyses review sentiment based on a review's content."""
-    analysis = TextBlob(review_text)
-    return analysis.sentiment.polarity
+    return sentiment.polarity(review_text)
 
 def find_similar_movies(cleaned_title, top_n=100):
-    """Finds similar movies based on the cleaned title's composite string."""
-    cleaned_title = cleaned_title.lower()
-    query_movie = Movie.objects.filter(title__iexact=cleaned_title).first()
-    if query_movie: # Check if the movie exists
-        query_vec = vectorizer.transform([query_movie.composite_string]) # Now use composite_string
-        similarity = cosine_similarity(query_vec, tfidf).flatten()
-
-        # Get top n similar movie IDs
-        top_indices = np.argsort(similarity)[-top_n:][::-1]  # Reverse for descending order
-        movie_ids = list(Movie.objects.values_list('movie_id', flat=True))
-
-        similar_movies = []
-        for i in top_indices:
-            movie_id = movie_ids[int(i)]
-            if movie_id != query_movie.pk:  # Exclude the query movie
-                similar_movies.append(movie_id)
-            if len(similar_movies) >= top_n:  # Stop after getting 10
-                break
-            
-        return Movie.objects.filter(movie_id__in=similar_movies)
-
-    return Movie.objects.none() 
+    """Finds similar movies based on the cleaned title's composite string, tolerating typos in the title."""
+    return similar_movies_to(search.resolve_title(cleaned_title).movie_id, top_n)
+
+def similar_movies_to(movie_id, top_n=100):
+    """Finds the movies most similar to the given one, most similar first."""
+    model = similarity.get_model()
+    similar_movies = similar_movie_ids(model, movie_id, top_n) if model is not None else []
+    if not similar_movies:
+        return Movie.objects.none()
+    # Keep the similarity ranking, which an unordered movie_id__in query would lose
+    ranking = Case(*[When(movie_id=movie_id, then=rank) for rank, movie_id in enumerate(similar_movies)])
+    return Movie.objects.filter(movie_id__in=similar_movies).order_by(ranking)
+
+def similar_movie_ids(model, movie_id, top_n=100):
+    """Returns the movie_ids most similar to the given one, cached per movie and model version."""
+    def compute():
+        query_movie = Movie.objects.filter(movie_id=movie_id).first() if movie_id is not None else None
+        return similarity.similar_movie_ids(model, query_movie, top_n) if query_movie else []
+
+    return recommendation_cache.similar_movies.get_or_compute((movie_id, top_n, model.version), compute)
+
+def content_recommendations(liked_movie_ids, count, exclude=(), seeds=5, candidates=100):
+    """Returns up to `count` movie_ids most similar in content to the first `seeds` liked movies, taking each one's nearest in turn.
+
+    Stands in for item_similarity.recommend until build_item_similarity has published a model.
+    """
+    model = similarity.get_model()
+    if model is None or count <= 0:
+        return []
+    seen = set(liked_movie_ids) | set(exclude)
+    recommended = []
+    neighbours = [similar_movie_ids(model, movie_id, candidates) for movie_id in liked_movie_ids[:seeds]]
+    for movie_ids in zip_longest(*neighbours):
+        for movie_id in movie_ids:
+            if movie_id is not None and movie_id not in seen:
+                seen.add(movie_id)
+                recommended.append(movie_id)
+    return recommended[:count]
+
+def cached_recommendations(movie_id, user, top_n=10, candidates=100):
+    """Returns the movie_ids get_final_recommendations would pick for a movie's `candidates` most similar movies.
+
+    Served from recommendation_cache: anonymous users share each movie's similar movies, and a signed in user's
+    reranked list is kept until they next rate a movie.
+    """
+    model = similarity.get_model()
+    if model is None or movie_id is None:
+        return []
+    if not user.is_authenticated:
+        return similar_movie_ids(model, movie_id, candidates)[:top_n]
+
+    key = (user.id, movie_id, top_n, model.version, recommendation_cache.rating_version(user.id))
+    def compute():
+        movie_ids = similar_movie_ids(model, movie_id, candidates)
+        predicted_ratings = predict_user_ratings(user, movie_ids) if movie_ids and should_rerank(user) else None
+        if predicted_ratings is not None:
+            movie_ids = sorted(movie_ids, key=lambda candidate: predicted_ratings.get(candidate, 0), reverse=True)
+        return movie_ids[:top_n]
+
+    return recommendation_cache.user_recommendations.get_or_compute(key, compute)
 
 
 def rerank_recommendations(movies, user):
@@ -53,57 +92,92 @@ def rerank_recommendations(movies, user):
     if not user.is_authenticated:
         return movies
 
-    user_ratings = Rating.objects.filter(user=user).values_list('movie__movie_id', 'rating')
-    user_movie_ids, user_ratings_list = zip(*user_ratings)  
-
-    # Calculating similarity scores using cosine_similarity and add to the similarity_scores dictionary
-    similarity_scores = {}
-    for other_user_id, movie_id, rating in Rating.objects.values_list('user__id', 'movie__movie_id', 'rating'):
-        if other_user_id != user.id and movie_id in [movie.movie_id for movie in movies]:
-            other_user_ratings = Rating.objects.filter(user__id=other_user_id).values_list('rating', flat=True)
-            similarity = cosine_similarity([user_ratings_list], [list(other_user_ratings)])[0][0]
-            similarity_scores.setdefault(movie_id, []).append((other_user_id, similarity, rating))
-    
-    predicted_ratings = {}
-    for movie in movies:
-        similar_users = similarity_scores.get(movie.movie_id, [])
-        weighted_sum = 0
-        similarity_sum = 0
-
-        # Ratings taken into account
-        for other_user_id, similarity, rating in similar_users:
-            weighted_sum += similarity * rating
-            similarity_sum += similarity
-
-        # Reviews taken into account
-        for other_user_id, similarity, rating in similar_users:
-            review = Review.objects.filter(user__id=other_user_id, movie=movie).first()
-            sentiment_weight = 1.0  # Neutral weight
-            if review:
-                sentiment = analyze_sentiment(review.review)
-                sentiment_weight = 1.0 + sentiment  # Increase weight for positive reviews, decrease for negative
-            weighted_sum += similarity * rating * sentiment_weight
-            similarity_sum += similarity
-
-        # Similarity score taken into account
-        if similarity_sum > 0: 
-            predicted_ratings[movie.movie_id] = weighted_sum / similarity_sum
-        else:
-            predicted_ratings[movie.movie_id] = 0 
+    predicted_ratings = predict_user_ratings(user, [movie.movie_id for movie in movies])
+    if predicted_ratings is None:
+        return movies
 
     reranked_movies = sorted(movies, key=lambda movie: predicted_ratings.get(movie.movie_id, 0), reverse=True)
     return reranked_movies
 
+def predict_user_ratings(user, movie_ids):
+    """Returns the user's predicted rating of each movie, or None if the user has not rated anything."""
+    ratings = collaborative.get_rating_matrix()
+    user_row = ratings.user_index.get(user.id)
+    if user_row is None:
+        return None
+
+    # Similarity to every other user over co-rated movies, then predicted ratings for all candidates at once
+    similarities = collaborative.user_similarities(ratings, user_row)
+    # only the reviews of similar users who rated a candidate can change a prediction
+    columns = [ratings.movie_index[movie_id] for movie_id in movie_ids if movie_id in ratings.movie_index]
+    rated_candidates = ratings.rated[:, columns].getnnz(axis=1) > 0
+    similar_user_ids = ratings.user_ids[(similarities != 0) & rated_candidates].tolist()
+    polarities = review_polarities(similar_user_ids, movie_ids)
+    return collaborative.predict_ratings(ratings, similarities, movie_ids, polarities)
+
+def review_polarities(user_ids, movie_ids):
+    """Returns the stored sentiment of each user's first review of each movie, keyed by (user_id, movie_id).
+
+    Reviews not scored yet (see the backfill_review_sentiment command) count as neutral.
+    Users are queried REVIEW_QUERY_CHUNK_SIZE at a time, however many there are.
+    """
+    polarities = {}
+    for start in range(0, len(user_ids), REVIEW_QUERY_CHUNK_SIZE):
+        reviews = Review.objects.filter(
+            user_id__in=user_ids[start:start + REVIEW_QUERY_CHUNK_SIZE], movie_id__in=movie_ids, sentiment__isnull=False
+        ).order_by('id')
+        for user_id, movie_id, review_sentiment in reviews.values_list('user_id', 'movie_id', 'sentiment'):
+            polarities.setdefault((user_id, movie_id), review_sentiment)
+    return polarities
+
 def get_final_recommendations(movies, user, top_n=10):
     """Use rerank only if the conditions are met - this is the function called in views.py"""
+    if should_rerank(user):
+        movies = rerank_recommendations(movies, user)
+
+    return movies[:top_n]
+
+def should_rerank(user):
+    """Whether the user and the site have enough ratings for collaborative reranking to help."""
     if not user.is_authenticated:
-        return movies[:top_n]
+        return False
 
     min_user_ratings_threshold = 5
     min_global_ratings_threshold = 1000
     total_ratings_count = Rating.objects.count()
 
-    if Rating.objects.filter(user=user).count() >= min_user_ratings_threshold and total_ratings_count >= min_global_ratings_threshold:
-        movies = rerank_recommendations(movies, user)
-
-    return movies[:top_n]
\ No newline at end of file
+    return Rating.objects.filter(user=user).count() >= min_user_ratings_threshold and total_ratings_count >= min_global_ratings_threshold
+
+def batch_recommendations(movie_ids, user, top_n=10, candidates=100):
+    """Recommendations for many movies at once, as a list per movie of {'movie_id', 'score'} dicts, best first.
+
+    Each movie's `candidates` most similar movies come from one sparse product over the whole batch
+    (see similarity.batch_similar_movie_ids); like get_final_recommendations, they are reranked by the
+    user's predicted ratings when there are enough ratings, with every candidate predicted in one pass.
+    A movie_id with no movie, or no model to score it with, gets an empty list.
+    """
+    model = similarity.get_model()
+    movies = Movie.objects.only('movie_id', *similarity.FIELDS).in_bulk(set(movie_ids))
+    known = [movies[movie_id] for movie_id in movie_ids if movie_id in movies]
+    if model is None or not known:
+        return [[] for _ in movie_ids]
+    similar = dict(zip([movie.movie_id for movie in known], similarity.batch_similar_movie_ids(model, known, candidates)))
+
+    predicted_ratings = None
+    if should_rerank(user):
+        candidate_ids = sorted({movie_id for ranked in similar.values() for movie_id, _ in ranked})
+        predicted_ratings = predict_user_ratings(user, candidate_ids)
+
+    results = []
+    for movie_id in movie_ids:
+        ranked = similar.get(movie_id, [])
+        if predicted_ratings is not None:
+            ranked = sorted(ranked, key=lambda candidate: predicted_ratings.get(candidate[0], 0), reverse=True)
+        recommendations = []
+        for candidate_id, score in ranked[:top_n]:
+            recommendation = {'movie_id': candidate_id, 'score': score}
+            if predicted_ratings is not None:
+                recommendation['predicted_rating'] = predicted_ratings.get(candidate_id, 0)
+            recommendations.append(recommendation)
+        results.append(recommendations)
+    return results
@@ -3,21 +3,26 @@
 
 import re
 import os
+import json
 import random
 import datetime
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
-from django.db.models import Avg, Count, Max
-from django.http import HttpResponseRedirect
+from django.db.models import F
+from django.http import HttpResponseRedirect, JsonResponse
 from django.core.paginator import Paginator
 from django.contrib import messages
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 import replicate
 import markdown2
 from .forms import MovieForm, CreateUserForm, ReviewForm, RatingForm, MovieSearchForm
-from .utils import initialize_tfidf, find_similar_movies, get_final_recommendations, rerank_recommendations
+from .utils import rerank_recommendations, batch_recommendations, cached_recommendations, content_recommendations
 from .models import Movie, Rating, Review, Watchlist
+from . import sections, sampling, movie_stats, item_similarity, search, warmup, recommendation_cache
 from dotenv import load_dotenv
 
 # Global variables
@@ -30,33 +35,82 @@ def general_search(request):
     search_results = None
 
     if form.is_valid():
-        search_term = form.cleaned_data['title'].lower()
-        search_results = Movie.objects.filter(title__icontains=search_term)
-    
+        # rank and paginate movie_ids, then load only the movies on this page
+        paginator = Paginator(search.search_movie_ids(form.cleaned_data['title']), settings.SEARCH_PAGE_SIZE)
+        search_results = paginator.get_page(request.GET.get('page'))
+        movies = Movie.objects.in_bulk(search_results.object_list)
+        search_results.object_list = [movies[movie_id] for movie_id in search_results.object_list if movie_id in movies]
+
     context = {'form': form, 'search_results': search_results}
 
     return render(request, 'search_results.html', context)
 
+# Typeahead for the movie_search title box, served from memory so it never queries the database
+def autocomplete(request):
+    try:
+        limit = int(request.GET.get('limit', settings.AUTOCOMPLETE_LIMIT))
+    except ValueError:
+        limit = settings.AUTOCOMPLETE_LIMIT
+    return JsonResponse({'results': search.complete_titles(request.GET.get('q', ''), limit)})
+
 # Movie recommendation functions
 def movie_search(request):
     form = MovieForm(request.POST or None)
     final_recommendations = None
-    similar_movies = None
+    resolution = None
 
     if request.method == 'POST':
         if form.is_valid():
             movie_title = form.cleaned_data['title'].lower()
             cleaned_movie_title = clean_title(movie_title)  # Make sure you have this function
-            initialize_tfidf()  # Initialize TF-IDF
-            similar_movies = find_similar_movies(cleaned_movie_title, top_n=100)
-            if similar_movies:
-                final_recommendations = get_final_recommendations(
-                    list(similar_movies), request.user, top_n=10
-                )  # Apply Hybrid Recommender
+            resolution = search.resolve_title(cleaned_movie_title)  # closest title, so typos still find the movie
+            # Hybrid recommender, usually served from the recommendation cache
+            recommended = cached_recommendations(resolution.movie_id, request.user, top_n=10, candidates=100)
+            if recommended:
+                movies = Movie.objects.in_bulk(recommended)
+                final_recommendations = [movies[movie_id] for movie_id in recommended if movie_id in movies]
         else:
             messages.error(request, "Invalid movie title, please try another")
 
-    return render(request, 'movie_search.html', {'form': form, 'final_recommendations': final_recommendations})
+    context = {'form': form, 'final_recommendations': final_recommendations, 'resolution': resolution}
+    return render(request, 'movie_search.html', context)
+
+# JSON recommendations for many movies in one request, for services precomputing carousels
+# POST {"movie_ids": [...], "titles": [...], "top_n": 10}; titles may be misspelt, they are resolved like movie_search
+@csrf_exempt
+@require_POST
+def recommendations_api(request):
+    try:
+        payload = json.loads(request.body)
+        movie_ids, titles = payload.get('movie_ids', []), payload.get('titles', [])
+        if not isinstance(movie_ids, list) or not isinstance(titles, list):
+            raise TypeError('movie_ids and titles must be lists')  # a string would be read a character at a time
+        movie_ids = [int(movie_id) for movie_id in movie_ids]
+        titles = [str(title) for title in titles]
+        top_n = int(payload.get('top_n', 10))
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'error': 'Expected a JSON object with movie_ids and/or titles lists'}, status=400)
+    if len(movie_ids) + len(titles) > settings.RECOMMENDATION_API_MAX_BATCH:
+        return JsonResponse({'error': f'At most {settings.RECOMMENDATION_API_MAX_BATCH} movies per request'}, status=400)
+    if not 0 < top_n <= 100:
+        return JsonResponse({'error': 'top_n must be between 1 and 100'}, status=400)
+
+    queries = [(movie_id, movie_id) for movie_id in movie_ids]
+    queries += [(title, search.resolve_title(clean_title(title.lower())).movie_id) for title in titles]
+    recommendations = batch_recommendations(
+        [movie_id for _, movie_id in queries if movie_id is not None], request.user, top_n=top_n
+    )
+    resolved = iter(recommendations)
+    results = [
+        {'query': query, 'movie_id': movie_id, 'recommendations': next(resolved) if movie_id is not None else []}
+        for query, movie_id in queries
+    ]
+    return JsonResponse({'results': results})
+
+# Readiness check for load balancers: 503 until this worker has every required model and index in memory
+def readiness(request):
+    ready, models = warmup.readiness()
+    return JsonResponse({'ready': ready, 'models': models, 'caches': recommendation_cache.stats()}, status=200 if ready else 503)
 
 # AI chatbot related functions
 def chatbot(request):
@@ -109,8 +163,9 @@ def process_user_input_with_llama(user_input):
 
 # Page details related functions
 def movie_details(request, pk):
-    movie = get_object_or_404(Movie, pk=pk)
-    average_rating = Rating.objects.filter(movie=movie).aggregate(Avg('rating'))['rating__avg']
+    # the average rating comes from MovieStats in the same query
+    movie = get_object_or_404(Movie.objects.annotate(avg_rating=F('stats__rating_mean')), pk=pk)
+    average_rating = movie.avg_rating
     user_rating = None
 
     if request.user.is_authenticated:
@@ -120,7 +175,6 @@ def movie_details(request, pk):
             pass
 
     # Initialize forms (outside POST handling)
-    reviews = Review.objects.filter(movie=movie)
     review_form = ReviewForm(request.POST or None)
     rating_form = RatingForm(request.POST or None)
 
@@ -131,26 +185,20 @@ def movie_details(request, pk):
             # Check which form was submitted
             if 'rating' in request.POST and rating_form.is_valid():
                 rating_value = rating_form.cleaned_data['rating']
-                Rating.objects.update_or_create(
-                    user=request.user,
-                    movie=movie,
-                    defaults={'rating': rating_value}
-                )
+                movie_stats.record_rating(request.user, movie, rating_value)
                 messages.success(request, "Your rating has been updated.")
-                average_rating = Rating.objects.filter(movie=movie).aggregate(Avg('rating'))['rating__avg']
-                user_rating = rating_value
                 return HttpResponseRedirect(request.path_info)
 
             elif 'review' in request.POST and review_form.is_valid():
                 review = review_form.save(commit=False)
                 review.user = request.user
                 review.movie = movie
-                review.save()
+                movie_stats.record_review(review)
                 messages.success(request, "Your review has been submitted!")
                 return HttpResponseRedirect(request.path_info)
 
-    # Paginate reviews
-    reviews_list = Review.objects.filter(movie=movie)
+    # Paginate reviews, with each reviewer loaded in the same query
+    reviews_list = Review.objects.filter(movie=movie).select_related('user').order_by('id')
     paginator = Paginator(reviews_list, 1)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
@@ -169,18 +217,11 @@ def movie_details(request, pk):
 
 def homepage(request):
     # Top 10 highest rated films
-    top_rated_films = Movie.objects.filter(rating__isnull=False) \
-        .annotate(avg_rating=Avg('rating__rating')) \
-        .order_by('-avg_rating')[:10]
+    top_rated_films = sections.top_rated_films()
     top_rated_films = list(top_rated_films) + list(get_random_movies(10 - len(top_rated_films), top_rated_films))
     
     # Most recently reviewed films
-    recently_reviewed_movies = Movie.objects.filter(
-        review__isnull=False
-    ).annotate(
-        avg_rating=Avg('rating__rating'),
-        latest_review=Max('review__created_at')
-    ).order_by('-latest_review')[:10]
+    recently_reviewed_movies = sections.recently_reviewed_movies()
     recently_reviewed_movies = list(recently_reviewed_movies) + list(get_random_movies(10 - len(recently_reviewed_movies), recently_reviewed_movies))
 
     # Movie recommendations
@@ -215,7 +256,7 @@ def remove_from_watchlist(request, movie_id):
 
 @login_required
 def view_watchlist(request):
-    watchlist = Watchlist.objects.filter(user=request.user)
+    watchlist = Watchlist.objects.filter(user=request.user).select_related('movie').order_by('id')
     return render(request, 'watchlist.html', {'watchlist': watchlist})
 
 # See Ratings and Reviews
@@ -283,12 +324,8 @@ def clean_title(movie_title):
     return re.sub("[^a-zA-Z0-9 ]", "", movie_title)
 
 def get_random_movies(count=10, existing_movies=None):
-    random_movies = []
-    while len(random_movies) < count:
-        new_movie = Movie.objects.order_by('?').first()  # Get a single random movie
-        if existing_movies is None or new_movie not in existing_movies:
-            random_movies.append(new_movie)
-    return random_movies
+    existing_ids = [movie.pk for movie in existing_movies] if existing_movies else []
+    return sampling.random_movies(count, exclude=existing_ids)
 
 def check_rate_limit(request):
     last_request_time_str = request.session.get('last_request_time')
@@ -301,45 +338,41 @@ def check_rate_limit(request):
 
 def get_recommendations(user):
     if user.is_authenticated:
-        user_ratings = Rating.objects.filter(user=user)
-        liked_movie_ids = user_ratings.filter(rating__gte=4).values_list('movie__movie_id', flat=True)
+        liked_movie_ids = list(Rating.objects.filter(user=user, rating__gte=4).values_list('movie_id', flat=True))
 
         if liked_movie_ids:
-            # Get movies that other users who liked the same movies also liked
-            recommended_movie_ids = Rating.objects.filter(
-                user__in=Rating.objects.filter(movie__movie_id__in=liked_movie_ids).values('user').distinct(),
-                rating__gte=4
-            ).exclude(
-                movie__movie_id__in=liked_movie_ids 
-            ).values('movie__movie_id').distinct()
-
-
-            recommended_movies = Movie.objects.filter(movie_id__in=recommended_movie_ids).annotate(
-                avg_rating=Avg('rating__rating')
-            )
+            # Movies that people who liked the same movies also liked, from the precomputed co-rating model,
+            # or movies like them in content until that model is first built
+            recommended_movie_ids = item_similarity.recommend(liked_movie_ids, 10)
+            if not item_similarity.published_model.loaded:
+                recommended_movie_ids = content_recommendations(liked_movie_ids, 10)
+            movies_by_id = Movie.objects.annotate(avg_rating=F('stats__rating_mean')).in_bulk(recommended_movie_ids)
+            recommended_movies = [movies_by_id[movie_id] for movie_id in recommended_movie_ids if movie_id in movies_by_id]
 
             # If not enough recommendations, fill with random movies
-            if recommended_movies.count() < 10:
-                remaining_needed = 10 - recommended_movies.count()
-                random_movies = Movie.objects.exclude(
-                    movie_id__in=list(liked_movie_ids) + list(recommended_movies.values_list('movie_id', flat=True))
-                ).annotate(
-                    avg_rating=Avg('rating__rating')
-                ).order_by('?')[:remaining_needed]
-                recommended_movies = list(recommended_movies) + list(random_movies)
+            if len(recommended_movies) < 10:
+                remaining_needed = 10 - len(recommended_movies)
+                random_movie_ids = sampling.sample_movie_ids(
+                    remaining_needed,
+                    exclude=liked_movie_ids + [movie.movie_id for movie in recommended_movies]
+                )
+                random_movies = Movie.objects.filter(movie_id__in=random_movie_ids).annotate(
+                    avg_rating=F('stats__rating_mean')
+                )
+                recommended_movies = recommended_movies + list(random_movies)
                 
             return recommended_movies[:10]
 
         else:
             # If no liked movies, return random movies
-            recommended_movies = Movie.objects.all().annotate(
-                avg_rating=Avg('rating__rating')
-            ).order_by('?')[:10]
+            recommended_movies = Movie.objects.filter(movie_id__in=sampling.sample_movie_ids(10)).annotate(
+                avg_rating=F('stats__rating_mean')
+            )
             return recommended_movies
 
     else:
         # If not logged in, return random movies
-        recommended_movies = Movie.objects.all().annotate(
-            avg_rating=Avg('rating__rating')
-        ).order_by('?')[:10]
+        recommended_movies = Movie.objects.filter(movie_id__in=sampling.sample_movie_ids(10)).annotate(
+            avg_rating=F('stats__rating_mean')
+        )
         return recommended_movies
\ No newline at end of file
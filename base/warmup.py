@@ -0,0 +1,59 @@
+# loads every recommendation model and catalogue index up front instead of on the first request that needs it
+# gunicorn.conf.py calls preload in the master process (preload_app), so forked workers, including ones
+# recycled by max_requests, start with everything already in memory and share its pages copy-on-write;
+# views.readiness reports what this process has loaded, for load balancer and deploy health checks
+
+import logging
+import time
+from django.conf import settings
+from django.db import connection
+from . import ann, collaborative, item_similarity, model_store, sampling, search, similarity, utils
+
+logger = logging.getLogger(__name__)
+
+
+def artefacts():
+    """Returns (name, PublishedModel or CatalogIndex, required) for everything this deployment serves from memory.
+
+    A model that is not required, like item_similarity before its first build, may be unpublished without
+    making the process unready.
+    """
+    entries = [
+        ('tfidf', similarity.published_model, True),
+        ('item_similarity', item_similarity.published_model, False),
+        ('completion_index', search.completion_index, True),
+        ('fuzzy_title_index', search.fuzzy_title_index, True),
+        ('sampling', sampling.movie_ids, True),
+        ('rating_matrix', collaborative.rating_matrix, True),
+    ]
+    if settings.SIMILARITY_BACKEND == 'ivf':
+        entries.append(('tfidf_ann', ann.published_index, False))
+    if connection.vendor != 'postgresql':  # PostgreSQL searches titles through its trigram index instead
+        entries.append(('title_index', search.title_index, True))
+    return entries
+
+def preload():
+    """Loads every artefact into this process."""
+    for name, artefact, _ in artefacts():
+        started = time.monotonic()
+        if artefact.get() is None:
+            logger.warning("Nothing is published for %s yet, requests use its fallback until it is built", name)
+            continue
+        logger.info("Preloaded %s in %.2fs", name, time.monotonic() - started)
+    utils.initialize_tfidf()
+
+def readiness():
+    """Returns whether everything required is loaded, and the loaded state and version of each artefact.
+
+    Only looks at what is already in memory and the published CURRENT files, so it never triggers a load.
+    """
+    models = {}
+    ready = True
+    for name, artefact, required in artefacts():
+        status = {'loaded': artefact.loaded}
+        if isinstance(artefact, model_store.PublishedModel):
+            status['version'] = artefact.model.version if artefact.loaded else None
+            required = required or artefact.available()
+        models[name] = status
+        ready = ready and (artefact.loaded or not required)
+    return ready, models
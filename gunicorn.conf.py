@@ -0,0 +1,19 @@
+# gunicorn settings, read automatically when gunicorn is started from this directory:
+#   gunicorn --workers 4 --max-requests 1000
+# The app and every recommendation model are loaded once in the master process before workers fork,
+# so workers share those pages copy-on-write and a recycled worker never serves a cold first request
+
+wsgi_app = 'base.wsgi:application'
+preload_app = True
+
+
+def when_ready(server):
+    from django.db import connections
+    from base import warmup
+    warmup.preload()
+    connections.close_all()  # otherwise every worker would inherit, and share, the master's database connection
+
+def post_worker_init(worker):
+    # usually a no-op; a worker forked long after the preload re-checks for newer models here, before accepting requests
+    from base import warmup
+    warmup.preload()